@@ -0,0 +1,123 @@
+import os
+import copy
+import time
+import threading
+import itertools
+import numpy as np
+from collections import OrderedDict
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+# Seconds an answer is reused; bounds how long a misclassified time-sensitive answer can be served
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+
+
+class SemanticAnswerCache:
+    """Cache of pipeline results looked up by query-embedding similarity, per knowledge-base version"""
+
+    def __init__(
+            self,
+            threshold: float = ANSWER_CACHE_THRESHOLD,
+            max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+            ttl: float = ANSWER_CACHE_TTL
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # entry id -> (kb_version, query, unit vector, result, expires_at)
+        self._matrices = {}            # kb_version -> (entry ids, stacked vectors, expiry times), rebuilt on change
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _matrix(self, kb_version: str) -> tuple:
+        if kb_version not in self._matrices:
+            entry_ids = [entry_id for entry_id, entry in self._entries.items() if entry[0] == kb_version]
+            vectors = np.stack([self._entries[entry_id][2] for entry_id in entry_ids]) if entry_ids else None
+            expires = np.array([self._entries[entry_id][4] for entry_id in entry_ids])
+            self._matrices[kb_version] = (entry_ids, vectors, expires)
+        return self._matrices[kb_version]
+
+    def _drop_expired(self, kb_version: str, now: float):
+        entry_ids, _, expires = self._matrix(kb_version)
+        expired = [entry_ids[i] for i in np.flatnonzero(expires <= now)]
+        if expired:
+            for entry_id in expired:
+                del self._entries[entry_id]
+            self._matrices.pop(kb_version, None)
+
+    def lookup(self, query_vector, kb_version: str):
+        """Nearest previously answered query for this knowledge base, if similar enough.
+
+        Returns (result, similarity, matched_query) or None.
+        """
+        query_vector = self._unit(query_vector)
+        with self._lock:
+            self._drop_expired(kb_version, time.time())
+            entry_ids, vectors, _ = self._matrix(kb_version)
+            if vectors is not None:
+                similarities = vectors @ query_vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    entry_id = entry_ids[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    _, matched_query, _, result, _ = self._entries[entry_id]
+                    return copy.deepcopy(result), float(similarities[best]), matched_query
+            self.misses += 1
+            return None
+
+    def store(self, query: str, query_vector, kb_version: str, result: dict):
+        """Remember a result for a query answered against a knowledge-base version"""
+        with self._lock:
+            self._entries[next(self._ids)] = (
+                kb_version, query, self._unit(query_vector), copy.deepcopy(result), time.time() + self.ttl
+            )
+            self._matrices.pop(kb_version, None)
+            while len(self._entries) > self.max_entries:
+                _, (evicted_version, _, _, _, _) = self._entries.popitem(last=False)
+                self._matrices.pop(evicted_version, None)
+
+    def invalidate(self, kb_version: str = None):
+        """Drop cached answers for one knowledge-base version, or all of them"""
+        with self._lock:
+            if kb_version is None:
+                self._entries.clear()
+                self._matrices.clear()
+                return
+            for entry_id in [entry_id for entry_id, entry in self._entries.items() if entry[0] == kb_version]:
+                del self._entries[entry_id]
+            self._matrices.pop(kb_version, None)
+
+    def get_stats(self) -> dict:
+        """Get cache hit/miss counters and size"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "ttl": self.ttl
+            }
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Get the process-wide semantic answer cache"""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = SemanticAnswerCache()
+        return _answer_cache
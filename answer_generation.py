@@ -1,11 +1,10 @@
-def generate_answer_enhanced(
-        llm, 
-        context: str, 
-        query: str, 
-        source_type: str, 
-        sources: list = None
-) -> str:
-    """Enhanced answer generation with source attribution"""
+from tracing import annotate, annotate_token_usage
+
+# Start of the answer text when generation fails
+ANSWER_ERROR_PREFIX = "Error generating answer"
+
+def build_answer_prompt(context: str, query: str, source_type: str) -> str:
+    """Build the answer prompt for the given source type"""
     if source_type == "hybrid":
         answer_prompt = f"""You are an expert AI assistant. Use the provided context from both local knowledge and current web information to answer the user's question comprehensively.
 
@@ -38,17 +37,69 @@ def generate_answer_enhanced(
 
     Answer:"""
     
+    return answer_prompt
+
+def format_source_attribution(source_type: str, sources: list = None) -> str:
+    """Source information appended to web and hybrid answers"""
+    if source_type in ["web", "hybrid"] and sources:
+        source_info = "\n\n**Web Sources:**\n"
+        for i, source in enumerate(sources[:3], 1):
+            source_info += f"{i}. {source.get('title', 'Unknown source')}\n"
+        return source_info
+    return ""
+
+def generate_answer_enhanced(
+        llm, 
+        context: str, 
+        query: str, 
+        source_type: str, 
+        sources: list = None
+) -> str:
+    """Enhanced answer generation with source attribution"""
+    answer_prompt = build_answer_prompt(context, query, source_type)
+    
     try:
         response = llm.invoke(answer_prompt)
+        annotate_token_usage(response)
         answer = response.content.strip()
         
         # Add source information
-        if source_type in ["web", "hybrid"] and sources:
-            source_info = "\n\n**Web Sources:**\n"
-            for i, source in enumerate(sources[:3], 1):
-                source_info += f"{i}. {source.get('title', 'Unknown source')}\n"
-            answer += source_info
+        answer += format_source_attribution(source_type, sources)
         
         return answer
     except Exception as e:
-        return f"Error generating answer: {str(e)}"
+        return f"{ANSWER_ERROR_PREFIX}: {str(e)}"
+
+def stream_answer_enhanced(
+        llm, 
+        context: str, 
+        query: str, 
+        source_type: str, 
+        sources: list = None
+):
+    """Streaming version of generate_answer_enhanced - yields answer text as tokens arrive.
+    
+    Errors are raised, not yielded: part of the answer may already have been shown,
+    so the caller decides how to report the failure.
+    """
+    answer_prompt = build_answer_prompt(context, query, source_type)
+    
+    started = False
+    chunks = 0
+    for chunk in llm.stream(answer_prompt):
+        chunks += 1
+        # Providers that report usage when streaming put it on the final chunk
+        annotate_token_usage(chunk)
+        text = chunk.content
+        if not started:
+            # Match the stripped output of generate_answer_enhanced
+            text = text.lstrip()
+            started = bool(text)
+        if text:
+            yield text
+    annotate(stream_chunks=chunks)
+    
+    # Source attribution goes at the end, once generation is done
+    source_info = format_source_attribution(source_type, sources)
+    if source_info:
+        yield source_info
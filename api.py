@@ -0,0 +1,218 @@
+"""Headless HTTP API for the RAG pipelines.
+
+Run with several workers behind a load balancer, e.g.:
+    uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+Each worker loads the models and default knowledge base once at startup. Documents
+added through /ingest are stored in KB_STORE_DIR under the "api" reference; every
+worker reloads them when the reference changes, so all workers serve the same
+knowledge base as long as they share KB_STORE_DIR.
+"""
+import io
+import os
+import time
+import asyncio
+import threading
+from typing import List, Literal
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, File, HTTPException, UploadFile
+from pydantic import BaseModel
+from utils import build_base_components
+from knowledge_base import create_default_knowledge_base, ingest_pdf_files
+from kb_store import compute_kb_key, get_kb_version, save_knowledge_base, load_knowledge_base, delete_knowledge_base
+from kb_store import read_kb_ref, write_kb_ref, kb_ref_stamp, kb_ref_lock
+from layered_store import LayeredVectorStore
+from document_registry import DocumentRegistry, content_doc_id
+from pipelines import traditional_rag_query_enhanced, agentic_rag_query_enhanced, run_pipelines
+from retrieval import RetrievalContext
+
+API_MAX_CONCURRENT_QUERIES = int(os.getenv("API_MAX_CONCURRENT_QUERIES", "16"))
+# How long a request may wait for a free slot before the worker reports it is overloaded
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "30"))
+# Name of the stored reference to the knowledge base the API serves
+API_KB_REF = "api"
+
+
+class QueryRequest(BaseModel):
+    query: str
+    mode: Literal["agentic", "traditional", "both"] = "agentic"
+    speculative_web: bool = False
+    # Opt-in: a cached answer can be up to ANSWER_CACHE_TTL seconds old
+    semantic_cache: bool = False
+    fast_router: bool = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models and the default index are loaded once per worker, off the event loop
+    app.state.started_at = time.time()
+    app.state.llm, app.state.embeddings = await asyncio.to_thread(build_base_components)
+    app.state.default_db = await asyncio.to_thread(create_default_knowledge_base, app.state.embeddings)
+    app.state.vector_db = LayeredVectorStore([app.state.default_db], app.state.embeddings)
+    app.state.knowledge_base = "default"
+    app.state.kb_ref_stamp = None
+    app.state.sync_lock = threading.Lock()
+    # Pick up documents ingested before this worker started
+    await asyncio.to_thread(_sync_knowledge_base)
+    app.state.query_slots = asyncio.Semaphore(API_MAX_CONCURRENT_QUERIES)
+    app.state.ingest_lock = asyncio.Lock()
+    app.state.startup_time = time.time() - app.state.started_at
+    yield
+
+
+app = FastAPI(title="Agentic RAG API", lifespan=lifespan)
+
+
+@asynccontextmanager
+async def _query_slot():
+    try:
+        await asyncio.wait_for(app.state.query_slots.acquire(), timeout=API_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Too many concurrent queries, try again later")
+    try:
+        yield
+    finally:
+        app.state.query_slots.release()
+
+
+def _load_kb_ref(ref: dict):
+    """The layered store a stored reference describes, or None if its session layer cannot be loaded"""
+    shared_dbs = [app.state.default_db] if ref["include_default"] else []
+    session_db = None
+    if ref["session_key"]:
+        session_db = load_knowledge_base(ref["session_key"], app.state.embeddings)
+        if session_db is None:
+            return None
+    return LayeredVectorStore(shared_dbs, app.state.embeddings, session_db)
+
+
+def _sync_knowledge_base():
+    """Reload the knowledge base if another worker changed it; a stat per call otherwise"""
+    with app.state.sync_lock:
+        stamp = kb_ref_stamp(API_KB_REF)
+        if stamp is None or stamp == app.state.kb_ref_stamp:
+            return
+        ref = read_kb_ref(API_KB_REF)
+        if ref["version"] != app.state.vector_db.kb_version():
+            vector_db = _load_kb_ref(ref)
+            if vector_db is None:
+                return  # Replaced again meanwhile; the next call sees the newer reference
+            app.state.vector_db = vector_db
+            app.state.knowledge_base = ref["knowledge_base"]
+        app.state.kb_ref_stamp = stamp
+
+
+def _ingest(uploads: list, replace: bool) -> dict:
+    """Add uploads to the stored knowledge base and publish it to every worker"""
+    embeddings = app.state.embeddings
+    with kb_ref_lock(API_KB_REF):
+        # Start from the latest stored state, whichever worker wrote it
+        _sync_knowledge_base()
+        previous_ref = read_kb_ref(API_KB_REF)
+        # Changes go to a copy; queries keep using the current store until the swap
+        vector_db = LayeredVectorStore([], embeddings) if replace else app.state.vector_db.copy()
+        registry = DocumentRegistry(vector_db, embeddings)
+
+        file_stats, new_files, skipped = [], [], 0
+        for upload in uploads:
+            doc_id = content_doc_id(upload.getvalue())
+            if registry.has(doc_id):
+                file_stats.append({"file_name": upload.name, "chunks": 0, "already_present": True})
+                skipped += 1
+            else:
+                new_files.append((upload, doc_id))
+        chunks_added = 0
+        # Each file's chunks are appended to the session layer; nothing is rebuilt
+        for (upload, doc_id), (file_db, chunks, stats) in zip(new_files, ingest_pdf_files([upload for upload, _ in new_files], embeddings)):
+            if stats:
+                file_stats.append(stats)
+            if chunks and registry.add_vector_db(doc_id, upload.name, file_db) is not None:
+                chunks_added += len(chunks)
+        if not chunks_added and not skipped:
+            raise HTTPException(status_code=422, detail={"error": "No text extracted from uploads", "files": file_stats})
+
+        vector_db = registry.vector_db
+        if chunks_added or replace:
+            session_key = None
+            if vector_db.session_db is not None:
+                session_key = compute_kb_key([get_kb_version(vector_db.session_db)], embeddings, params={"ref": API_KB_REF})
+                if not save_knowledge_base(session_key, vector_db.session_db, embeddings, name=f"{API_KB_REF} ingested documents"):
+                    raise HTTPException(status_code=500, detail="Could not store the knowledge base")
+            knowledge_base = "default" if vector_db.shared_dbs and session_key is None else "custom"
+            write_kb_ref(API_KB_REF, {
+                "version": vector_db.kb_version(),
+                "session_key": session_key,
+                "include_default": bool(vector_db.shared_dbs),
+                "knowledge_base": knowledge_base,
+                "updated_at": time.time()
+            })
+            if previous_ref and previous_ref["session_key"] not in (None, session_key):
+                delete_knowledge_base(previous_ref["session_key"])
+            with app.state.sync_lock:
+                # Swap atomically; in-flight queries keep using the store they started with
+                app.state.vector_db = vector_db
+                app.state.knowledge_base = knowledge_base
+                app.state.kb_ref_stamp = kb_ref_stamp(API_KB_REF)
+
+    return {"files": file_stats, "chunks_added": chunks_added, "num_chunks": vector_db.ntotal}
+
+
+def _run_query(request: QueryRequest, vector_db) -> dict:
+    llm = app.state.llm
+    agentic_options = {
+        "speculative_web": request.speculative_web,
+        "semantic_cache": request.semantic_cache,
+        "fast_router": request.fast_router
+    }
+    if request.mode == "traditional":
+        return {"traditional": traditional_rag_query_enhanced(llm, vector_db, request.query)}
+    if request.mode == "agentic":
+        return {"agentic": agentic_rag_query_enhanced(llm, vector_db, request.query, **agentic_options)}
+
+    retrieval_context = RetrievalContext(vector_db, request.query)
+    traditional_result, agentic_result, timings = run_pipelines(
+        llm, vector_db, request.query, retrieval_context=retrieval_context, **agentic_options
+    )
+    return {"traditional": traditional_result, "agentic": agentic_result, "timings": timings}
+
+
+@app.get("/health")
+async def health() -> dict:
+    """Liveness/readiness for the load balancer"""
+    await asyncio.to_thread(_sync_knowledge_base)
+    return {
+        "status": "ok",
+        "knowledge_base": app.state.knowledge_base,
+        "num_chunks": app.state.vector_db.ntotal,
+        "kb_version": app.state.vector_db.kb_version(),
+        "startup_time": round(app.state.startup_time, 3),
+        "uptime": round(time.time() - app.state.started_at, 3)
+    }
+
+
+@app.post("/query")
+async def query(request: QueryRequest) -> dict:
+    """Answer a question with the agentic pipeline, the traditional one, or both"""
+    if not request.query.strip():
+        raise HTTPException(status_code=400, detail="Query must not be empty")
+
+    async with _query_slot():
+        # Pipelines block on network and model calls, so they run in a worker thread
+        await asyncio.to_thread(_sync_knowledge_base)
+        vector_db = app.state.vector_db
+        return await asyncio.to_thread(_run_query, request, vector_db)
+
+
+@app.post("/ingest")
+async def ingest(files: List[UploadFile] = File(...), replace: bool = False) -> dict:
+    """Add uploaded PDFs to the knowledge base of all workers, or replace it with them.
+
+    Files already in the knowledge base (same content) are skipped.
+    """
+    uploads = []
+    for file in files:
+        upload = io.BytesIO(await file.read())
+        upload.name = file.filename
+        uploads.append(upload)
+
+    async with app.state.ingest_lock:
+        return await asyncio.to_thread(_ingest, uploads, replace)
@@ -0,0 +1,213 @@
+"""Run a JSONL file of queries through the RAG pipelines.
+
+Each input line is {"id": ..., "query": ...} (or a bare JSON string). Results are
+appended to the output JSONL as each query completes; --resume skips ids that
+already have a successful result in the output file.
+
+    python batch.py queries.jsonl results.jsonl --pipelines agentic,traditional --workers 4 --rate-limit 2
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from utils import build_base_components
+from kb_store import load_knowledge_base
+from knowledge_base import create_default_knowledge_base, ingest_uploaded_pdfs
+from pipelines import traditional_rag_query_enhanced, agentic_rag_query_enhanced, run_pipelines
+
+PIPELINES = ("traditional", "agentic")
+
+
+class RateLimiter:
+    """Spaces out query starts so at most `rate` begin per second across all workers"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self.next_start)
+            self.next_start = start_at + self.interval
+        time.sleep(max(0.0, start_at - now))
+
+
+def read_queries(path: str) -> list:
+    """Read (id, query) pairs from a JSONL file"""
+    queries = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"query": record}
+            queries.append((str(record.get("id", line_number)), record["query"]))
+    return queries
+
+
+def read_completed_ids(path: str) -> set:
+    """Ids that already have a successful result in an output file"""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Partial line from an interrupted run
+            if not record.get("error"):
+                completed.add(str(record["id"]))
+    return completed
+
+
+def truncate_partial_line(path: str):
+    """Cut a partial last line left by an interrupted run, so appended records start on a line of their own"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        size = f.seek(0, os.SEEK_END)
+        if not size:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return
+        # Scan back in blocks for the last newline
+        end = size
+        while end > 0:
+            start = max(0, end - 65536)
+            f.seek(start)
+            block = f.read(end - start)
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                f.truncate(start + newline + 1)
+                return
+            end = start
+        f.truncate(0)
+
+
+def load_vector_db(args, embeddings):
+    """Knowledge base for the run: stored key, uploaded PDFs or the default documents"""
+    if args.kb_key:
+        vector_db = load_knowledge_base(args.kb_key, embeddings)
+        if vector_db is None:
+            sys.exit(f"Stored knowledge base {args.kb_key} not found")
+        return vector_db
+
+    if args.pdf:
+        uploads = []
+        for path in args.pdf:
+            with open(path, "rb") as f:
+                upload = io.BytesIO(f.read())
+            upload.name = os.path.basename(path)
+            uploads.append(upload)
+        vector_db, all_chunks, file_stats = ingest_uploaded_pdfs(uploads, embeddings)
+        for stats in file_stats:
+            if stats.get("error"):
+                print(f"Failed to ingest {stats['file_name']}: {stats['error']}", file=sys.stderr)
+            else:
+                print(f"Ingested {stats['file_name']}: {stats['chunks']} chunks", file=sys.stderr)
+        if not all_chunks:
+            sys.exit("No text extracted from the given PDFs")
+        return vector_db
+
+    return create_default_knowledge_base(embeddings)
+
+
+def run_query(llm, vector_db, query_id: str, query: str, pipelines: list, agentic_options: dict) -> dict:
+    """Run one query through the selected pipelines, capturing errors in the record"""
+    start_time = time.time()
+    record = {"id": query_id, "query": query}
+    try:
+        if set(pipelines) == {"agentic", "traditional"}:
+            record["traditional"], record["agentic"], record["timings"] = run_pipelines(
+                llm, vector_db, query, **agentic_options
+            )
+        elif pipelines == ["traditional"]:
+            record["traditional"] = traditional_rag_query_enhanced(llm, vector_db, query)
+        else:
+            record["agentic"] = agentic_rag_query_enhanced(llm, vector_db, query, **agentic_options)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed"] = round(time.time() - start_time, 3)
+    return record
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Run JSONL queries through the RAG pipelines")
+    parser.add_argument("input", help="JSONL file of queries")
+    parser.add_argument("output", help="JSONL file results are appended to")
+    parser.add_argument("--pipelines", default="agentic,traditional",
+                        help="Comma-separated pipelines to run: agentic, traditional")
+    parser.add_argument("--workers", type=int, default=4, help="Queries processed at once")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="Maximum queries started per second (0 = unlimited)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip queries that already have a successful result in the output")
+    parser.add_argument("--pdf", nargs="+", help="PDFs to build the knowledge base from")
+    parser.add_argument("--kb-key", help="Key of a stored knowledge base to query")
+    parser.add_argument("--speculative-web", action="store_true", help="Enable speculative web search")
+    parser.add_argument("--semantic-cache", action="store_true",
+                        help="Reuse answers to near-identical earlier queries (off by default)")
+    parser.add_argument("--no-fast-router", action="store_true", help="Always use the LLM router")
+    args = parser.parse_args(argv)
+
+    # Each pipeline once, in the order given
+    pipelines = list(dict.fromkeys(name.strip() for name in args.pipelines.split(",") if name.strip()))
+    if not pipelines or any(name not in PIPELINES for name in pipelines):
+        parser.error(f"--pipelines must be a comma-separated subset of {', '.join(PIPELINES)}")
+    agentic_options = {
+        "speculative_web": args.speculative_web,
+        "semantic_cache": args.semantic_cache,
+        "fast_router": not args.no_fast_router
+    }
+
+    queries = read_queries(args.input)
+    if args.resume:
+        completed = read_completed_ids(args.output)
+        queries = [(query_id, query) for query_id, query in queries if query_id not in completed]
+        print(f"Resuming: {len(completed)} already done, {len(queries)} remaining", file=sys.stderr)
+
+    llm, embeddings = build_base_components()
+    vector_db = load_vector_db(args, embeddings)
+
+    rate_limiter = RateLimiter(args.rate_limit)
+    write_lock = threading.Lock()
+    failures = 0
+    run_start = time.time()
+
+    def rate_limited_query(query_id, query):
+        rate_limiter.wait()
+        return run_query(llm, vector_db, query_id, query, pipelines, agentic_options)
+
+    truncate_partial_line(args.output)
+    with open(args.output, "a") as output, ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(rate_limited_query, query_id, query) for query_id, query in queries]
+        for done, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            failures += bool(record.get("error"))
+            # One line per completed query, flushed so an interrupted run can be resumed
+            with write_lock:
+                output.write(json.dumps(record, default=str) + "\n")
+                output.flush()
+            print(f"[{done}/{len(futures)}] {record['id']} {record['elapsed']:.2f}s"
+                  + (f" ERROR {record['error']}" if record.get("error") else ""), file=sys.stderr)
+
+    elapsed = time.time() - run_start
+    print(f"Completed {len(queries)} queries in {elapsed:.1f}s "
+          f"({len(queries) / elapsed if elapsed else 0:.2f} queries/s), {failures} failed", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
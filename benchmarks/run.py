@@ -0,0 +1,330 @@
+"""Offline latency benchmarks for ingestion, retrieval and the RAG pipelines.
+
+The LLM, embedding model and Serper API are replaced with deterministic local
+stand-ins (benchmarks/standins.py), so runs measure this code rather than network
+weather. Results are written as JSON; --compare prints deltas against an earlier run.
+
+    python -m benchmarks.run --corpus-sizes 100,1000 --queries 30 --output bench.json
+    python -m benchmarks.run --output after.json --compare before.json
+"""
+import gc
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+import tracemalloc
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from langchain.schema import Document
+from benchmarks.standins import HashEmbeddings, FakeChatModel, SerperStandIn
+from search_client import SerperClient, set_search_client
+from web_cache import WebResultCache, set_web_cache
+from knowledge_base import embed_chunks
+import retrieval
+import pipelines
+
+QUERY_KINDS = ("local", "web", "hybrid")
+TOPICS = [
+    "pipeline", "warehouse", "streaming", "governance", "embedding", "retrieval", "router",
+    "latency", "cluster", "schema", "migration", "compliance", "agent", "vector", "index",
+    "partition", "replication", "scheduler", "airflow", "snowflake", "kinesis", "spark",
+    "notebook", "dashboard", "contract", "lineage", "catalog", "quality", "monitoring", "cache"
+]
+FILLER = ["the", "system", "uses", "a", "for", "with", "and", "team", "data", "each", "daily", "new"]
+
+
+class StageTimer:
+    """Collects durations per stage from wrapped functions"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def wrap(self, stage: str, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+        return timed
+
+    def reset(self):
+        with self._lock:
+            self.samples = {}
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {stage: summarize(values) for stage, values in sorted(self.samples.items())}
+
+
+def summarize(values: list) -> dict:
+    """Count, mean and percentiles in milliseconds"""
+    values = np.asarray(values) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "max_ms": round(float(values.max()), 3)
+    }
+
+
+def instrument(timer: StageTimer):
+    """Wrap the pipeline stages in timers; returns a function that undoes it"""
+    patches = [
+        (retrieval, "embed_query", "query_embedding"),
+        (pipelines, "fast_route", "fast_route"),
+        (pipelines, "check_local_knowledge_enhanced", "llm_router"),
+        (pipelines, "get_web_content_enhanced", "web_search"),
+        (pipelines, "generate_answer_enhanced", "answer_generation"),
+    ]
+    originals = [(module, name, getattr(module, name)) for module, name, _ in patches]
+    for module, name, stage in patches:
+        setattr(module, name, timer.wrap(stage, getattr(module, name)))
+
+    def restore():
+        for module, name, original in originals:
+            setattr(module, name, original)
+    return restore
+
+
+def make_corpus(size: int, seed: int) -> list:
+    """Synthetic chunk-sized documents, each built around a few topic words"""
+    rng = random.Random(seed)
+    documents = []
+    for i in range(size):
+        topics = rng.sample(TOPICS, 3) + [f"entity{i}"]
+        words = []
+        while sum(len(word) + 1 for word in words) < 900:
+            words.append(rng.choice(topics) if rng.random() < 0.3 else rng.choice(FILLER))
+        documents.append(Document(
+            page_content=" ".join(words),
+            metadata={"source": f"synthetic_{i // 20}.pdf", "page": i % 20 + 1}
+        ))
+    return documents
+
+
+def make_queries(documents: list, count: int, mix: dict, seed: int) -> list:
+    """(kind, query) pairs in the requested local/web/hybrid proportions.
+
+    Local queries are excerpts of a stored chunk, web queries are temporal and off-topic,
+    and hybrid queries sit in between so they reach the LLM router.
+    """
+    rng = random.Random(seed)
+    total = sum(mix.values())
+    kinds = [kind for kind in QUERY_KINDS for _ in range(round(count * mix.get(kind, 0) / total))]
+    rng.shuffle(kinds)
+    queries = []
+    for i, kind in enumerate(kinds):
+        document = rng.choice(documents)
+        words = document.page_content.split()
+        if kind == "local":
+            start = rng.randrange(max(1, len(words) - 60))
+            query = " ".join(words[start:start + 60])
+        elif kind == "web":
+            query = f"latest news today about unrelated topic {i} zebra{i} quasar{i}"
+        else:
+            extra = " ".join(f"vendor{i}term{j}" for j in range(8))
+            query = f"{' '.join(rng.sample(words, 12))} {extra}"
+        queries.append((kind, query))
+    return queries
+
+
+def run_query(llm, vector_db, query: str, pipeline: str, concurrent: bool) -> dict:
+    if pipeline == "both":
+        _, _, timings = pipelines.run_pipelines(llm, vector_db, query, concurrent=concurrent, semantic_cache=False)
+        return timings
+    if pipeline == "traditional":
+        return {"traditional": pipelines.traditional_rag_query_enhanced(llm, vector_db, query)["processing_time"]}
+    result = pipelines.agentic_rag_query_enhanced(llm, vector_db, query, semantic_cache=False)
+    return {"agentic": result["processing_time"], "route": result["route_decision"], "router": result["router"]}
+
+
+def benchmark_ingestion(documents: list, embeddings) -> tuple:
+    """Build the index once for timing and once under tracemalloc for peak memory"""
+    start = time.perf_counter()
+    vector_db, embed_time = embed_chunks(documents, embeddings)
+    ingest_time = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    embed_chunks(documents, embeddings)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return vector_db, {
+        "chunks": len(documents),
+        "total_s": round(ingest_time, 4),
+        "embedding_s": round(embed_time, 4),
+        "chunks_per_s": round(len(documents) / ingest_time, 1) if ingest_time else None,
+        "peak_traced_mb": round(peak / 2 ** 20, 2)
+    }
+
+
+def benchmark_corpus(size: int, args, llm, embeddings) -> dict:
+    documents = make_corpus(size, args.seed)
+    vector_db, ingestion = benchmark_ingestion(documents, embeddings)
+
+    timer = StageTimer()
+    vector_db.similarity_search_with_score_by_vector = timer.wrap(
+        "vector_search", vector_db.similarity_search_with_score_by_vector
+    )
+    queries = make_queries(documents, args.queries, args.mix, args.seed)
+    llm.routes = {query: "HYBRID" for kind, query in queries if kind == "hybrid"}
+
+    results = {"corpus_size": size, "ingestion": ingestion, "pipelines": {}}
+    restore = instrument(timer)
+    try:
+        for pipeline in args.pipelines:
+            timer.reset()
+            per_query = {}
+            routes = {}
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                futures = [
+                    (kind, executor.submit(run_query, llm, vector_db, query, pipeline, args.concurrent_pipelines))
+                    for kind, query in queries
+                ]
+                for kind, future in futures:
+                    timings = future.result()
+                    for name in ("traditional", "agentic", "wall_clock"):
+                        if name in timings:
+                            per_query.setdefault(name, []).append(timings[name])
+                            per_query.setdefault(f"{name}[{kind}]", []).append(timings[name])
+                    if "route" in timings:
+                        route = f"{timings['route']} via {timings['router']}"
+                        routes[route] = routes.get(route, 0) + 1
+            elapsed = time.perf_counter() - start
+
+            results["pipelines"][pipeline] = {
+                "queries": len(queries),
+                "elapsed_s": round(elapsed, 3),
+                "throughput_qps": round(len(queries) / elapsed, 3) if elapsed else None,
+                "end_to_end": {name: summarize(values) for name, values in sorted(per_query.items())},
+                "stages": timer.summary(),
+                "routes": routes
+            }
+    finally:
+        restore()
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Lines describing metric changes between two result files beyond the threshold (percent)"""
+    lines = []
+    baseline_runs = {run["corpus_size"]: run for run in baseline["results"]}
+    for run in current["results"]:
+        old_run = baseline_runs.get(run["corpus_size"])
+        if old_run is None:
+            continue
+        metrics = [("ingestion", "total_s", run["ingestion"]["total_s"], old_run["ingestion"]["total_s"])]
+        for pipeline, stats in run["pipelines"].items():
+            old_stats = old_run["pipelines"].get(pipeline)
+            if old_stats is None:
+                continue
+            metrics.append((pipeline, "throughput_qps", stats["throughput_qps"], old_stats["throughput_qps"]))
+            for group in ("end_to_end", "stages"):
+                for name, summary in stats[group].items():
+                    if name in old_stats[group]:
+                        metrics.append((pipeline, f"{name} p50_ms", summary["p50_ms"], old_stats[group][name]["p50_ms"]))
+                        metrics.append((pipeline, f"{name} p95_ms", summary["p95_ms"], old_stats[group][name]["p95_ms"]))
+        for scope, name, new, old in metrics:
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            if abs(change) >= threshold:
+                lines.append(f"corpus={run['corpus_size']:<6} {scope:<12} {name:<40} {old:>10.3f} -> {new:>10.3f} ({change:+.1f}%)")
+    return lines
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in QUERY_KINDS:
+            raise argparse.ArgumentTypeError(f"query kinds are {', '.join(QUERY_KINDS)}")
+        mix[kind] = float(weight)
+    return mix
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Offline latency benchmarks with stand-in backends")
+    parser.add_argument("--corpus-sizes", default="100,1000", help="Comma-separated chunk counts")
+    parser.add_argument("--queries", type=int, default=30, help="Queries per corpus size")
+    parser.add_argument("--mix", type=parse_mix, default="local=0.5,web=0.25,hybrid=0.25",
+                        help="Query mix, e.g. local=0.5,web=0.25,hybrid=0.25")
+    parser.add_argument("--pipelines", default="agentic,traditional,both",
+                        help="Comma-separated: agentic, traditional, both (run_pipelines)")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per stand-in LLM call")
+    parser.add_argument("--search-latency", type=float, default=0.3, help="Seconds per stand-in search request")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Seconds per embedded text")
+    parser.add_argument("--concurrency", type=int, default=4, help="Queries in flight at once")
+    parser.add_argument("--sequential-pipelines", dest="concurrent_pipelines", action="store_false",
+                        help="Run the two pipelines one after the other in 'both' mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--compare", help="Earlier results JSON to diff against")
+    parser.add_argument("--threshold", type=float, default=5.0, help="Only report changes of at least this percent")
+    args = parser.parse_args(argv)
+    args.pipelines = [name.strip() for name in args.pipelines.split(",") if name.strip()]
+
+    llm = FakeChatModel(latency=args.llm_latency)
+    embeddings = HashEmbeddings(latency_per_text=args.embed_latency)
+    # Every search goes to the stand-in; a zero TTL cache keeps repeated queries honest
+    set_web_cache(WebResultCache(ttl=0))
+
+    results = []
+    with SerperStandIn(latency=args.search_latency) as search_server:
+        set_search_client(SerperClient("benchmark-key", url=search_server.url, max_concurrency=args.concurrency * 2))
+        for size in [int(size) for size in args.corpus_sizes.split(",")]:
+            print(f"Corpus of {size} chunks...", file=sys.stderr)
+            results.append(benchmark_corpus(size, args, llm, embeddings))
+        search_requests = search_server.requests
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+            "search_requests": search_requests,
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        },
+        "results": results
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Changes >= {args.threshold}% vs {args.compare} ({baseline['meta'].get('commit')}):", file=sys.stderr)
+        for line in compare(report, baseline, args.threshold) or ["none"]:
+            print(line, file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Deterministic local stand-ins for the LLM, the embedding model and the Serper API."""
+import re
+import json
+import time
+import zlib
+import random
+import hashlib
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from langchain_core.embeddings import Embeddings
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class HashEmbeddings(Embeddings):
+    """Bag-of-words embeddings hashed into a fixed dimension, L2-normalized.
+
+    Texts sharing words get similar vectors, so retrieval behaves sensibly, and no model
+    is loaded. `latency_per_text` simulates model cost.
+    """
+
+    def __init__(self, dim: int = 768, latency_per_text: float = 0.0):
+        self.dim = dim
+        self.latency_per_text = latency_per_text
+        self.model_name = f"benchmark-hash-{dim}"
+
+    def _embed(self, text: str) -> list:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in WORD_PATTERN.findall(text.lower()):
+            bucket = zlib.crc32(word.encode("utf-8"))
+            vector[bucket % self.dim] += 1.0 if bucket & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list) -> list:
+        if self.latency_per_text:
+            time.sleep(self.latency_per_text * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+class _Message:
+    def __init__(self, content: str, usage_metadata: dict = None):
+        self.content = content
+        self.usage_metadata = usage_metadata or {}
+
+
+class FakeChatModel:
+    """Chat model stand-in with configurable latency and canned router output.
+
+    `routes` maps query text to the route the router should return; other queries get
+    `default_route`. Answers are fixed text streamed in `stream_chunks` pieces.
+    """
+
+    ANSWER = ("Based on the provided context, here is a detailed answer covering the key points "
+              "of the question with supporting facts from the retrieved sources. ") * 3
+
+    def __init__(self, latency: float = 0.2, routes: dict = None, default_route: str = "HYBRID",
+                 time_to_first_token: float = None, stream_chunks: int = 20):
+        self.latency = latency
+        self.routes = routes or {}
+        self.default_route = default_route
+        self.time_to_first_token = latency / 4 if time_to_first_token is None else time_to_first_token
+        self.stream_chunks = stream_chunks
+
+    def _respond(self, prompt: str) -> str:
+        if "query router" in prompt:
+            match = re.search(r'Query: "(.*)"', prompt)
+            route = self.routes.get(match.group(1) if match else "", self.default_route)
+            return (f"Route: {route}\nConfidence: MEDIUM\nReasoning: Canned benchmark decision\n"
+                    f"Context_Match: 0.5\nTemporal_Need: NO")
+        return self.ANSWER
+
+    def _usage(self, prompt: str, answer: str) -> dict:
+        return {"input_tokens": len(prompt) // 4, "output_tokens": len(answer) // 4}
+
+    def invoke(self, prompt: str) -> _Message:
+        time.sleep(self.latency)
+        answer = self._respond(prompt)
+        return _Message(answer, self._usage(prompt, answer))
+
+    def stream(self, prompt: str):
+        answer = self._respond(prompt)
+        time.sleep(self.time_to_first_token)
+        piece = max(1, len(answer) // self.stream_chunks)
+        per_piece = max(0.0, self.latency - self.time_to_first_token) / self.stream_chunks
+        for start in range(0, len(answer), piece):
+            yield _Message(answer[start:start + piece])
+            time.sleep(per_piece)
+
+
+class SerperStandIn:
+    """Local HTTP server that answers like the Serper search API, with configurable latency.
+
+    Use as a context manager; `url` is the endpoint to give the search client.
+    """
+
+    def __init__(self, latency: float = 0.3, num_results: int = 5):
+        self.latency = latency
+        self.num_results = num_results
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _results(self, query: str) -> dict:
+        seed = int(hashlib.sha256(query.encode("utf-8")).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        return {
+            "searchInformation": {"totalResults": str(rng.randint(1000, 10 ** 6)), "searchTime": self.latency},
+            "organic": [
+                {
+                    "position": i + 1,
+                    "title": f"Result {i + 1} for {query}",
+                    "link": f"https://example{rng.randint(1, 50)}.com/{seed}/{i}",
+                    "snippet": f"Snippet {i + 1} about {query}. " * 4
+                }
+                for i in range(self.num_results)
+            ]
+        }
+
+    def __enter__(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stand_in._lock:
+                    stand_in.requests += 1
+                time.sleep(stand_in.latency)
+                body = json.dumps(stand_in._results(payload["q"])).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}/search"
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,228 @@
+"""Prompt context assembly under a token budget.
+
+Retrieved chunks repeat text - the splitter overlaps neighbouring chunks by CHUNK_OVERLAP
+characters - and HYBRID routing adds web snippets on top, so the prompt (and with it LLM
+latency and cost) used to grow with k and the size of the results. Here the chunks are
+cut to the ones scoring close to the best (adaptive k), chunks of the same page that
+overlap or touch are merged with the repeated span dropped, and the result is cut off at
+CONTEXT_TOKEN_BUDGET tokens, of which web snippets may take CONTEXT_WEB_SHARE.
+"""
+import os
+import math
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Share of the budget HYBRID answers may spend on web snippets; local chunks get the rest
+CONTEXT_WEB_SHARE = float(os.getenv("CONTEXT_WEB_SHARE", "0.4"))
+# Chunks matched by vector search alone are dropped when their similarity is this far below the best
+ADAPTIVE_K_SCORE_GAP = float(os.getenv("ADAPTIVE_K_SCORE_GAP", "0.25"))
+# Llama-family tokenizers average about 4 characters per English token
+CHARS_PER_TOKEN = 4
+# Shortest repeated span taken for splitter overlap rather than coincidence
+_MIN_OVERLAP_CHARS = 20
+# Chunks whose start_index ranges are at most this far apart are adjacent (stripped whitespace)
+_MAX_ADJACENT_GAP = 3
+# A truncated piece must keep at least this many tokens to be worth including
+_MIN_PIECE_TOKENS = 40
+
+LOCAL_HEADER = "**Local Knowledge:**\n"
+WEB_HEADER = "**Current Web Information:**\n"
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def select_chunks(docs_with_scores: list, matches: dict = None, key=None, gap: float = ADAPTIVE_K_SCORE_GAP) -> list:
+    """Adaptive k: keep the best chunk, keyword matches, and chunks within `gap` similarity of the best"""
+    similarities = [1 - float(score) for _, score in docs_with_scores if score is not None]
+    if not similarities:
+        return list(docs_with_scores)
+    floor = max(similarities) - gap
+    selected = []
+    for i, (doc, score) in enumerate(docs_with_scores):
+        match = (matches or {}).get(key(doc) if key else doc.page_content, "semantic")
+        if i == 0 or match != "semantic" or score is None or 1 - float(score) >= floor:
+            selected.append((doc, score))
+    return selected
+
+
+def _text_overlap(first: str, second: str) -> int:
+    """Length of the longest suffix of `first` that starts `second`"""
+    for length in range(min(len(first), len(second)), _MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def _join(first: dict, second: dict):
+    """`first` followed by `second` if they are neighbouring text of one page, else None"""
+    first_start, second_start = first.get("start"), second.get("start")
+    if first_start is not None and second_start is not None:
+        if second_start < first_start:
+            return None
+        first_end = first_start + len(first["text"])
+        if second_start > first_end + _MAX_ADJACENT_GAP:
+            return None
+        overlap = max(first_end - second_start, 0)
+        separator = "" if second_start <= first_end else " "
+        if overlap >= len(second["text"]):
+            # second lies within first
+            overlap = len(second["text"])
+            text = first["text"]
+        else:
+            text = first["text"] + separator + second["text"][overlap:]
+    else:
+        if second["text"] in first["text"]:
+            overlap = len(second["text"])
+            text = first["text"]
+        else:
+            overlap = _text_overlap(first["text"], second["text"])
+            if not overlap:
+                return None
+            text = first["text"] + second["text"][overlap:]
+    return {
+        **first,
+        "text": text,
+        "chunks": first["chunks"] + second["chunks"],
+        "overlap": first["overlap"] + second["overlap"] + overlap,
+        "rank": min(first["rank"], second["rank"])
+    }
+
+
+def merge_chunks(docs: list) -> list:
+    """Merge chunks of the same page that overlap or touch, in reading order.
+
+    Returns pieces ({"text", "source", "page", "chunks", "overlap", "rank"}) ordered by the
+    best retrieval rank among their chunks; "overlap" counts the repeated characters dropped.
+    """
+    pieces = []
+    for rank, doc in enumerate(docs):
+        piece = {
+            "text": doc.page_content.strip(),
+            "source": doc.metadata.get("source"),
+            "page": doc.metadata.get("page"),
+            "start": doc.metadata.get("start_index"),
+            "chunks": 1,
+            "overlap": 0,
+            "rank": rank
+        }
+        # Exact repeats (e.g. one chunk found in two layers) are dropped outright
+        duplicate = next((other for other in pieces if other["text"] == piece["text"]), None)
+        if duplicate is not None:
+            duplicate.update(chunks=duplicate["chunks"] + 1, overlap=duplicate["overlap"] + len(piece["text"]))
+            continue
+        merged = True
+        while merged:
+            merged = False
+            for i, other in enumerate(pieces):
+                if (other["source"], other["page"]) != (piece["source"], piece["page"]):
+                    continue
+                joined = _join(other, piece) or _join(piece, other)
+                if joined is not None:
+                    piece = joined
+                    pieces.pop(i)
+                    merged = True
+                    break
+        pieces.append(piece)
+    return sorted(pieces, key=lambda piece: piece["rank"])
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, at a sentence or word boundary where there is one"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind(". "), cut.rfind("\n"))
+    if boundary < max_chars // 2:
+        boundary = cut.rfind(" ")
+    return cut[:boundary + 1].rstrip() if boundary > 0 else cut
+
+
+def fit_to_budget(texts: list, budget: int, separator: str = "\n\n") -> tuple:
+    """Take texts in order until the token budget runs out; the last one may be truncated.
+
+    Returns (kept texts, whether anything was cut).
+    """
+    kept, used = [], 0
+    separator_tokens = estimate_tokens(separator)
+    for text in texts:
+        cost = estimate_tokens(text) + (separator_tokens if kept else 0)
+        if used + cost <= budget:
+            kept.append(text)
+            used += cost
+            continue
+        remaining = budget - used - (separator_tokens if kept else 0)
+        if remaining >= _MIN_PIECE_TOKENS:
+            kept.append(truncate_to_tokens(text, remaining))
+        return kept, True
+    return kept, False
+
+
+def build_local_context(docs_with_scores: list, matches: dict = None, key=None, budget: int = CONTEXT_TOKEN_BUDGET) -> dict:
+    """Context text from ranked (document, distance) hits, with what it saved.
+
+    Returns {"content", "pieces", "selected", "stats"}: "selected" are the hits kept by
+    adaptive k, "pieces" the merged texts before the budget cut (for re-budgeting in HYBRID).
+    """
+    selected = select_chunks(docs_with_scores, matches, key)
+    merged = merge_chunks([doc for doc, _ in selected])
+    pieces = [piece["text"] for piece in merged]
+    kept, truncated = fit_to_budget(pieces, budget)
+    content = "\n\n".join(kept)
+    # What the context used to be: every retrieved chunk, joined as retrieved
+    tokens_retrieved = estimate_tokens(" ".join(doc.page_content for doc, _ in docs_with_scores))
+    return {
+        "content": content,
+        "pieces": pieces,
+        "selected": selected,
+        "stats": context_stats(tokens_retrieved, estimate_tokens(content), budget, {
+            "chunks_retrieved": len(docs_with_scores),
+            "chunks_selected": len(selected),
+            "chunks_merged": len(selected) - len(merged),
+            "overlap_chars_removed": sum(piece["overlap"] for piece in merged),
+            "pieces": len(kept),
+            "truncated": truncated
+        })
+    }
+
+
+def build_web_context(web_content: str, budget: int = CONTEXT_TOKEN_BUDGET) -> tuple:
+    """Web snippets ("**Source n**" blocks) cut to the budget; (content, stats)"""
+    kept, truncated = fit_to_budget(web_content.split("\n\n"), budget) if web_content else ([], False)
+    content = "\n\n".join(kept)
+    return content, context_stats(estimate_tokens(web_content), estimate_tokens(content), budget, {
+        "web_snippets": len(kept),
+        "truncated": truncated
+    })
+
+
+def build_hybrid_context(local_pieces: list, local_stats: dict, web_content: str, budget: int = CONTEXT_TOKEN_BUDGET) -> tuple:
+    """Local pieces (from build_local_context) and web snippets in one budget; (content, stats).
+
+    Web snippets take at most CONTEXT_WEB_SHARE of the budget.
+    """
+    header_tokens = estimate_tokens(LOCAL_HEADER + "\n\n" + WEB_HEADER)
+    content_budget = max(budget - header_tokens, 0)
+    web, _ = build_web_context(web_content, int(content_budget * CONTEXT_WEB_SHARE))
+    # Budget the web snippets do not use goes to local chunks
+    local_kept, local_truncated = fit_to_budget(local_pieces, content_budget - estimate_tokens(web))
+    content = f"{LOCAL_HEADER}" + "\n\n".join(local_kept) + f"\n\n{WEB_HEADER}{web}"
+    # Before: the local chunks joined as retrieved, plus every snippet
+    tokens_retrieved = local_stats["tokens_retrieved"] + estimate_tokens(web_content) + header_tokens
+    return content, context_stats(tokens_retrieved, estimate_tokens(content), budget, {
+        **{name: value for name, value in local_stats.items() if name.startswith(("chunks_", "overlap_"))},
+        "pieces": len(local_kept),
+        "web_snippets": len([block for block in web.split("\n\n") if block]),
+        "truncated": local_truncated or web != web_content
+    })
+
+
+def context_stats(tokens_retrieved: int, tokens_used: int, budget: int, details: dict) -> dict:
+    return {
+        "tokens_retrieved": tokens_retrieved,
+        "tokens_used": tokens_used,
+        "tokens_saved": max(tokens_retrieved - tokens_used, 0),
+        "budget": budget,
+        **details
+    }
@@ -106,6 +106,41 @@ def apply_custom_css():
             color: white;
             border: 1px solid #4ecdc4;
         }
+        .trace-row {
+            display: flex;
+            align-items: center;
+            font-size: 0.85rem;
+            margin: 0.15rem 0;
+        }
+        .trace-label {
+            width: 35%;
+            white-space: nowrap;
+            overflow: hidden;
+            text-overflow: ellipsis;
+        }
+        .trace-track {
+            position: relative;
+            width: 65%;
+            height: 1.1rem;
+            background: #f1f3f5;
+            border-radius: 4px;
+        }
+        .trace-bar {
+            position: absolute;
+            height: 100%;
+            min-width: 2px;
+            border-radius: 4px;
+            background: #4ecdc4;
+        }
+        .trace-bar-nested {
+            background: #9be3de;
+        }
+        .trace-duration {
+            position: absolute;
+            right: 0.3rem;
+            font-size: 0.75rem;
+            color: #495057;
+        }
         .metric-card {
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             padding: 1.5rem;
@@ -0,0 +1,157 @@
+import time
+import hashlib
+import threading
+import weakref
+from langchain_community.vectorstores import FAISS
+from kb_store import invalidate_kb_version
+from layered_store import LayeredVectorStore
+from lexical_index import get_lexical_index, index_keywords
+from vector_index import describe_index, source_vectors, build_vector_db, index_matches_config
+
+
+def content_doc_id(content) -> str:
+    """Stable document id from the document's content, e.g. the bytes of an uploaded file"""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()[:16]
+
+
+def chunk_id(doc_id: str, position: int) -> str:
+    """Stable id of a document's n-th chunk, used as its docstore id"""
+    return f"{doc_id}-{position:05d}"
+
+
+def find_documents(vector_db) -> dict:
+    """Documents in a FAISS vector database, by their `doc_id` metadata or else grouped by source"""
+    groups = {}
+    for i in range(len(vector_db.index_to_docstore_id)):
+        docstore_id = vector_db.index_to_docstore_id[i]
+        doc = vector_db.docstore.search(docstore_id)
+        source = doc.metadata.get("source", "unknown")
+        group = groups.setdefault(doc.metadata.get("doc_id") or ("source", source), {"name": source, "chunk_ids": [], "texts": []})
+        group["chunk_ids"].append(docstore_id)
+        group["texts"].append(doc.page_content)
+    documents = {}
+    for key, group in groups.items():
+        # Chunks added without a registry get an id from their source's text
+        doc_id = key if isinstance(key, str) else content_doc_id("\n".join(group["texts"]))
+        documents[doc_id] = {"doc_id": doc_id, "name": group["name"], "chunk_ids": group["chunk_ids"], "added_at": None}
+    return documents
+
+
+# Shared layers never change, so their documents are found once per process
+_shared_documents = weakref.WeakKeyDictionary()
+
+
+def _find_shared_documents(vector_db) -> dict:
+    documents = _shared_documents.get(vector_db)
+    if documents is None:
+        documents = _shared_documents[vector_db] = find_documents(vector_db)
+    return documents
+
+
+class DocumentRegistry:
+    """The documents of a session's knowledge base, added and removed in place by stable id.
+
+    The knowledge base is a LayeredVectorStore: documents of the shared base stay in its
+    read-only layers, new documents are appended to the session layer. Removing a session
+    document deletes its vectors; removing a shared one hides its chunks for this session.
+    Read `registry.vector_db` for the store to search.
+    """
+
+    def __init__(self, vector_db, embeddings):
+        if not isinstance(vector_db, LayeredVectorStore):
+            vector_db = LayeredVectorStore([vector_db], embeddings)
+        self.vector_db = vector_db
+        self.embeddings = embeddings
+        self.documents = {}
+        self._lock = threading.Lock()
+        for shared_db in vector_db.shared_dbs:
+            for doc_id, doc in _find_shared_documents(shared_db).items():
+                if not vector_db.hidden_ids.issuperset(doc["chunk_ids"]):
+                    self.documents[doc_id] = {**doc, "layer": "shared"}
+        if vector_db.session_db is not None:
+            for doc_id, doc in find_documents(vector_db.session_db).items():
+                self.documents[doc_id] = {**doc, "layer": "session"}
+
+    def has(self, doc_id: str) -> bool:
+        return doc_id in self.documents
+
+    def list_documents(self) -> list:
+        return [
+            {"doc_id": doc["doc_id"], "name": doc["name"], "chunks": len(doc["chunk_ids"]),
+             "layer": doc["layer"], "added_at": doc["added_at"]}
+            for doc in self.documents.values()
+        ]
+
+    def add_document(self, doc_id: str, name: str, chunks: list, vectors) -> list:
+        """Append a document's chunks and precomputed vectors; returns its chunk ids, or None if already present"""
+        with self._lock:
+            if doc_id in self.documents:
+                return None
+            chunk_ids = [chunk_id(doc_id, i) for i in range(len(chunks))]
+            text_embeddings = list(zip((chunk.page_content for chunk in chunks), (list(vector) for vector in vectors)))
+            metadatas = [{**chunk.metadata, "doc_id": doc_id} for chunk in chunks]
+            if self.vector_db.session_db is None:
+                self.vector_db.session_db = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=chunk_ids)
+            else:
+                self.vector_db.session_db.add_embeddings(text_embeddings, metadatas=metadatas, ids=chunk_ids)
+            self.documents[doc_id] = {"doc_id": doc_id, "name": name, "chunk_ids": chunk_ids, "added_at": time.time(), "layer": "session"}
+            self._changed()
+            return chunk_ids
+
+    def add_vector_db(self, doc_id: str, name: str, document_db) -> list:
+        """Append the chunks and vectors of a single-document vector database (e.g. one stored PDF)"""
+        chunks = [
+            document_db.docstore.search(document_db.index_to_docstore_id[i])
+            for i in range(document_db.index.ntotal)
+        ]
+        return self.add_document(doc_id, name, chunks, source_vectors(document_db, self.embeddings))
+
+    def remove_document(self, doc_id: str) -> int:
+        """Remove a document from this session's knowledge base; returns the number of chunks removed"""
+        with self._lock:
+            doc = self.documents.pop(doc_id, None)
+            if doc is None:
+                return 0
+            if doc["layer"] == "shared":
+                # Other sessions still use the shared layer
+                self.vector_db.hidden_ids.update(doc["chunk_ids"])
+            else:
+                try:
+                    self.vector_db.session_db.delete(doc["chunk_ids"])
+                    lexical_index = get_lexical_index(self.vector_db.session_db, build=False)
+                    if lexical_index is not None:
+                        lexical_index.remove(doc["chunk_ids"])
+                except RuntimeError:
+                    # HNSW graphs (and refine wrappers) cannot drop vectors: rebuild from the rest
+                    self._rebuild(set(doc["chunk_ids"]))
+            self._changed()
+            return len(doc["chunk_ids"])
+
+    def _changed(self):
+        session_db = self.vector_db.session_db
+        # Growing past VECTOR_INDEX_ANN_MIN_SIZE (or shrinking below it) calls for a different index
+        if session_db is not None and session_db.index.ntotal and not index_matches_config(session_db.index):
+            self._rebuild()
+        if self.vector_db.session_db is not None:
+            invalidate_kb_version(self.vector_db.session_db)
+            index_keywords(self.vector_db.session_db)
+        self.vector_db.invalidate()
+
+    def _rebuild(self, dropped_ids: set = frozenset()):
+        session_db = self.vector_db.session_db
+        info = describe_index(session_db.index)
+        positions = [i for i in range(len(session_db.index_to_docstore_id)) if session_db.index_to_docstore_id[i] not in dropped_ids]
+        ids = [session_db.index_to_docstore_id[i] for i in positions]
+        documents = [session_db.docstore.search(docstore_id) for docstore_id in ids]
+        if not ids:
+            self.vector_db.session_db = None
+            return
+        # Exact vectors, so compressed storage is not quantized again on every rebuild
+        vectors = source_vectors(session_db, self.embeddings, positions)
+        if dropped_ids:
+            # Only dropping vectors: keep the index as it is configured now
+            self.vector_db.session_db = build_vector_db(self.embeddings, vectors, ids, documents, info["type"], info["storage"], info["refine"])
+        else:
+            self.vector_db.session_db = build_vector_db(self.embeddings, vectors, ids, documents)
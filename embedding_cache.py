@@ -0,0 +1,181 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from langchain_core.embeddings import Embeddings
+from kb_store import get_embedding_model_name
+from tracing import annotate
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", ".embedding_cache.sqlite")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_DTYPE = os.getenv("EMBEDDING_CACHE_DTYPE", "float16")
+# Query vectors are kept in memory only: one-off queries would otherwise cost a disk write each
+EMBEDDING_QUERY_CACHE_SIZE = int(os.getenv("EMBEDDING_QUERY_CACHE_SIZE", "1024"))
+
+# SQLite limits the number of bound parameters per statement
+_SQL_BATCH_SIZE = 500
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that caches document vectors on disk, keyed by model name and text hash.
+
+    Query vectors go to a small in-memory LRU instead, so queries never touch SQLite.
+    """
+
+    def __init__(
+            self,
+            underlying: Embeddings,
+            path: str = EMBEDDING_CACHE_PATH,
+            max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+            dtype: str = EMBEDDING_CACHE_DTYPE,
+            query_cache_size: int = EMBEDDING_QUERY_CACHE_SIZE
+    ):
+        self.underlying = underlying
+        self.model_name = get_embedding_model_name(underlying)
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self.query_cache_size = query_cache_size
+        self._queries = OrderedDict()  # query key -> vector
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key TEXT PRIMARY KEY, dtype TEXT, vector BLOB, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        # Counted once here and kept up to date on insert and evict, instead of a COUNT(*) per insert
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _key(self, text: str, kind: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).hexdigest()
+
+    def _encode(self, vector) -> bytes:
+        return np.asarray(vector, dtype=self.dtype).tobytes()
+
+    @staticmethod
+    def _decode(dtype: str, blob: bytes) -> list:
+        return np.frombuffer(blob, dtype=dtype).astype(np.float32).tolist()
+
+    def _lookup(self, keys: list) -> dict:
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = keys[i:i + _SQL_BATCH_SIZE]
+                rows = self._conn.execute(
+                    f"SELECT key, dtype, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, dtype, blob in rows:
+                    found[key] = self._decode(dtype, blob)
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, keyed_vectors: dict) -> dict:
+        """Store vectors and return them as they will be read back, so hits and misses agree"""
+        now = time.time()
+        rows = [(key, self.dtype.name, self._encode(vector), now) for key, vector in keyed_vectors.items()]
+        with self._lock:
+            # A key another writer stored meanwhile holds the same text's vector: keep it
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, dtype, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows
+            ).rowcount
+            self._count += max(inserted, 0)
+            if self._count > self.max_entries:
+                self._evict()
+            self._conn.commit()
+        return {key: self._decode(dtype, blob) for key, dtype, blob, _ in rows}
+
+    def _evict(self):
+        # Drop the least recently used tenth once the limit is exceeded, so eviction is not per-insert.
+        # Other processes may share the file, so the count is checked before deleting.
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if self._count > self.max_entries:
+            excess = self._count - int(self.max_entries * 0.9)
+            self._count -= self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            ).rowcount
+
+    def _embed_cached(self, texts: list, kind: str, embed_fn) -> list:
+        keys = [self._key(text, kind) for text in texts]
+        vectors = self._lookup(list(dict.fromkeys(keys)))
+
+        # Embed each missing text once, even if it repeats within the batch
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        annotate(embedding_cache_hits=len(texts) - len(missing), embedding_cache_misses=len(missing))
+
+        if missing:
+            new_vectors = embed_fn(list(missing.values()))
+            vectors.update(self._store(dict(zip(missing.keys(), new_vectors))))
+
+        return [vectors[key] for key in keys]
+
+    def embed_documents(self, texts: list) -> list:
+        """Embed documents, computing only chunks not already in the cache"""
+        return self._embed_cached(texts, "document", self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> list:
+        """Embed a query through the in-memory query cache"""
+        key = self._key(text, "query")
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        annotate(embedding_cache_hits=int(vector is not None), embedding_cache_misses=int(vector is None))
+        if vector is not None:
+            return list(vector)
+
+        vector = self.underlying.embed_query(text)
+        with self._lock:
+            self._queries[key] = vector
+            while len(self._queries) > self.query_cache_size:
+                self._queries.popitem(last=False)
+        return list(vector)
+
+    def get_stats(self) -> dict:
+        """Get cache hit/miss counters and size"""
+        with self._lock:
+            entries = self._count
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "query_entries": len(self._queries)
+            }
+
+    def clear(self):
+        """Remove all cached vectors"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._count = 0
+            self._queries.clear()
@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import shutil
+import pickle
+import hashlib
+import weakref
+from contextlib import contextmanager
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.faiss import dependable_faiss_import
+from vector_index import configure_search, describe_index
+from lexical_index import get_lexical_index, attach_lexical_index
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Not available on Windows: references are then only locked within a process
+
+# Knowledge bases are stored as <KB_STORE_DIR>/<key>/{index.faiss, index.pkl, lexical.pkl, meta.json}
+KB_STORE_DIR = os.getenv("KB_STORE_DIR", ".kb_store")
+# Named references to stored knowledge bases, e.g. the one the API workers serve
+KB_REFS_DIR = os.path.join(KB_STORE_DIR, "refs")
+
+
+def get_embedding_model_name(embeddings) -> str:
+    """Get a stable name for the embedding model behind an embeddings object"""
+    return getattr(embeddings, "model_name", None) or type(embeddings).__name__
+
+
+def compute_kb_key(parts: list, embeddings, params: dict = None) -> str:
+    """Compute a content-addressed key from source content, embedding model and build parameters"""
+    key_hash = hashlib.sha256()
+    key_hash.update(get_embedding_model_name(embeddings).encode("utf-8"))
+    key_hash.update(json.dumps(params or {}, sort_keys=True).encode("utf-8"))
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        key_hash.update(hashlib.sha256(part).digest())
+    return key_hash.hexdigest()[:32]
+
+
+def documents_fingerprint(documents) -> list:
+    """Turn documents into hashable parts for compute_kb_key"""
+    return [
+        doc.page_content + json.dumps(doc.metadata, sort_keys=True, default=str)
+        for doc in documents
+    ]
+
+
+_kb_versions = weakref.WeakKeyDictionary()
+
+
+def get_kb_version(vector_db) -> str:
+    """Identify the current contents of a vector database, e.g. to key caches on it"""
+    if hasattr(vector_db, "kb_version"):
+        # Layered stores combine the versions of their layers
+        return vector_db.kb_version()
+    size = len(vector_db.index_to_docstore_id)
+    cached = _kb_versions.get(vector_db)
+    if cached is not None and cached[0] == size:
+        return cached[1]
+
+    # Docstore ids are stable once stored, so the same stored base gives the same version everywhere
+    version_hash = hashlib.sha256()
+    for i in range(size):
+        version_hash.update(vector_db.index_to_docstore_id[i].encode("utf-8"))
+    version = version_hash.hexdigest()[:16]
+    _kb_versions[vector_db] = (size, version)
+    return version
+
+
+def invalidate_kb_version(vector_db):
+    """Forget the cached version of a vector database changed in place (its size alone may not change)"""
+    _kb_versions.pop(vector_db, None)
+
+
+def _kb_path(key: str) -> str:
+    return os.path.join(KB_STORE_DIR, key)
+
+
+def save_knowledge_base(key: str, vector_db, embeddings, name: str, extra: dict = None) -> bool:
+    """Save a vector database to the store under its content key"""
+    path = _kb_path(key)
+    tmp_path = f"{path}.tmp-{os.getpid()}-{time.time_ns()}"
+    try:
+        vector_db.save_local(tmp_path)
+        lexical_index = get_lexical_index(vector_db, build=False)
+        if lexical_index is not None:
+            with open(os.path.join(tmp_path, "lexical.pkl"), "wb") as f:
+                pickle.dump(lexical_index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        meta = {
+            "key": key,
+            "name": name,
+            "embedding_model": get_embedding_model_name(embeddings),
+            "num_vectors": vector_db.index.ntotal,
+            "index": describe_index(vector_db.index),
+            "created_at": time.time(),
+            **(extra or {})
+        }
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        # Another session may have stored the same content meanwhile - keep the existing copy
+        if os.path.exists(path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        else:
+            os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        print(f"Error saving knowledge base {key}: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return False
+
+
+def load_knowledge_base(key: str, embeddings, mmap: bool = True):
+    """Load a stored vector database, memory-mapping the index where FAISS supports it"""
+    path = _kb_path(key)
+    index_path = os.path.join(path, "index.faiss")
+    if not os.path.exists(index_path):
+        return None
+
+    faiss = dependable_faiss_import()
+    try:
+        index = None
+        if mmap:
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except Exception:
+                index = None  # Index type does not support memory-mapping
+        if index is None:
+            index = faiss.read_index(index_path)
+        configure_search(index)
+
+        # The pickle is only ever written by save_knowledge_base
+        with open(os.path.join(path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+
+        vector_db = FAISS(embeddings, index, docstore, index_to_docstore_id)
+        # Bases stored without a keyword index get one built on first search
+        lexical_path = os.path.join(path, "lexical.pkl")
+        if os.path.exists(lexical_path):
+            with open(lexical_path, "rb") as f:
+                attach_lexical_index(vector_db, pickle.load(f))
+        return vector_db
+    except Exception as e:
+        print(f"Error loading knowledge base {key}: {e}")
+        return None
+
+
+def list_knowledge_bases() -> list:
+    """List stored knowledge bases, newest first"""
+    if not os.path.isdir(KB_STORE_DIR):
+        return []
+
+    knowledge_bases = []
+    for key in os.listdir(KB_STORE_DIR):
+        meta_path = os.path.join(_kb_path(key), "meta.json")
+        if not os.path.exists(meta_path):
+            continue
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except Exception:
+            continue
+        meta["size_bytes"] = sum(
+            entry.stat().st_size for entry in os.scandir(_kb_path(key)) if entry.is_file()
+        )
+        knowledge_bases.append(meta)
+
+    return sorted(knowledge_bases, key=lambda meta: meta.get("created_at", 0), reverse=True)
+
+
+def delete_knowledge_base(key: str) -> bool:
+    """Delete a stored knowledge base"""
+    path = _kb_path(key)
+    if not os.path.isdir(path):
+        return False
+    shutil.rmtree(path, ignore_errors=True)
+    return True
+
+
+def _ref_path(name: str) -> str:
+    return os.path.join(KB_REFS_DIR, f"{name}.json")
+
+
+def read_kb_ref(name: str):
+    """Read a named reference, or None if it was never written"""
+    try:
+        with open(_ref_path(name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def kb_ref_stamp(name: str):
+    """Identity of the current reference file, to check cheaply whether it was rewritten"""
+    try:
+        stat = os.stat(_ref_path(name))
+    except FileNotFoundError:
+        return None
+    # Each write replaces the file, so the inode changes even where mtimes are coarse
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def write_kb_ref(name: str, ref: dict):
+    """Point a named reference at new contents; readers see the old or the new file, never a mix"""
+    os.makedirs(KB_REFS_DIR, exist_ok=True)
+    tmp_path = f"{_ref_path(name)}.tmp-{os.getpid()}-{time.time_ns()}"
+    with open(tmp_path, "w") as f:
+        json.dump(ref, f)
+    os.replace(tmp_path, _ref_path(name))
+
+
+@contextmanager
+def kb_ref_lock(name: str):
+    """Hold a named reference exclusively across processes, for read-modify-write updates"""
+    os.makedirs(KB_REFS_DIR, exist_ok=True)
+    with open(os.path.join(KB_REFS_DIR, f"{name}.lock"), "w") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -1,8 +1,19 @@
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
-import tempfile,os, streamlit as st
+import os, time, streamlit as st
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from langchain_community.vectorstores import FAISS
+import numpy as np
+from kb_store import compute_kb_key, documents_fingerprint, save_knowledge_base, load_knowledge_base
+from vector_index import index_matches_config, source_vectors, build_vector_db
+from lexical_index import index_keywords
+from pdf_parsing import CHUNK_SIZE, CHUNK_OVERLAP, stream_pdf_chunks, parse_pdf
+
+# Chunks embedded and appended to the index at a time while a PDF is streamed in
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "64"))
+# Processes parsing new PDFs when several are uploaded at once (0 = one per CPU, 1 = no pool)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
 
 default_docs = [
     Document(
@@ -85,39 +96,298 @@ default_docs = [
 
 
 def create_default_knowledge_base(embeddings):
-    """Create default knowledge base with sample documents"""   
-    return FAISS.from_documents(default_docs, embeddings)
+    """Create default knowledge base with sample documents, reusing the stored copy if present"""   
+    kb_key = compute_kb_key(documents_fingerprint(default_docs), embeddings)
+    vector_db = load_knowledge_base(kb_key, embeddings)
+    if vector_db is None:
+        vector_db = FAISS.from_documents(default_docs, embeddings)
+        index_keywords(vector_db)
+        save_knowledge_base(kb_key, vector_db, embeddings, name="default_docs")
+    return vector_db
+
+def get_stored_chunks(vector_db):
+    """Get the document chunks of a vector database in index order"""
+    return [
+        vector_db.docstore.search(vector_db.index_to_docstore_id[i])
+        for i in range(len(vector_db.index_to_docstore_id))
+    ]
+
+def embed_chunks(doc_chunks, embeddings):
+    """Embed document chunks once and build a vector database from the vectors"""
+    vector_db, _, embed_time = embed_chunk_stream(doc_chunks, embeddings)
+    return vector_db, embed_time
+
+def merge_vector_dbs(vector_dbs, embeddings, index_type=None, storage=None):
+    """Merge per-file vector databases into one index without re-embedding.
+    
+    Per-file databases are flat; the merged index is built with the configured
+    index type and vector storage (see vector_index), so large collections get an
+    ANN index and sessions can hold compressed vectors.
+    """
+    if len(vector_dbs) == 1 and index_matches_config(vector_dbs[0].index, index_type, storage):
+        return vector_dbs[0]
+    
+    # Docstore ids are carried over so the knowledge-base version stays stable, and vectors
+    # are the exact ones, so a compressed index is never built from decoded approximations
+    ids, documents, vectors = [], [], []
+    for vector_db in vector_dbs:
+        db_ids = [vector_db.index_to_docstore_id[i] for i in range(vector_db.index.ntotal)]
+        ids.extend(db_ids)
+        documents.extend(vector_db.docstore.search(doc_id) for doc_id in db_ids)
+        vectors.append(source_vectors(vector_db, embeddings))
+    merged_db = build_vector_db(embeddings, np.vstack(vectors), ids, documents, index_type, storage)
+    index_keywords(merged_db)
+    return merged_db
+
+def embed_chunk_stream(chunks, embeddings, batch_size=INGEST_EMBED_BATCH_SIZE, progress_callback=None, source=None):
+    """Embed chunks in fixed-size batches, appending each batch to one vector database.
+
+    Returns (vector_db, doc_chunks, embed_time); vector_db is None when there were no chunks.
+    """
+    vector_db, doc_chunks, batch = None, [], []
+    embed_time = 0.0
+    
+    def flush():
+        nonlocal vector_db, embed_time
+        texts = [chunk.page_content for chunk in batch]
+        metadatas = [chunk.metadata for chunk in batch]
+        embed_start_time = time.time()
+        vectors = embeddings.embed_documents(texts)
+        embed_time += time.time() - embed_start_time
+        if vector_db is None:
+            vector_db = FAISS.from_embeddings(list(zip(texts, vectors)), embeddings, metadatas=metadatas)
+        else:
+            vector_db.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+        # The batch's terms go into the keyword index as its vectors go into FAISS
+        index_keywords(vector_db)
+        doc_chunks.extend(batch)
+        batch.clear()
+        if progress_callback:
+            progress_callback({"file_name": source, "stage": "batch", "embedded": len(doc_chunks)})
+    
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return vector_db, doc_chunks, embed_time
+
+def pdf_kb_key(file_bytes, embeddings):
+    """Stored knowledge-base key of one uploaded PDF"""
+    return compute_kb_key(
+        [file_bytes], embeddings,
+        params={"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+    )
+
+def load_stored_pdf(file_name, kb_key, embeddings):
+    """(vector_db, chunks, stats) of a PDF seen before with the same model and chunking, else None"""
+    vector_db = load_knowledge_base(kb_key, embeddings)
+    if vector_db is None:
+        return None
+    doc_chunks = get_stored_chunks(vector_db)
+    return vector_db, doc_chunks, {
+        "file_name": file_name,
+        "chunks": len(doc_chunks),
+        "embedding_time": 0.0,
+        "from_store": True
+    }
+
+def failed_file_stats(file_name, error):
+    return {"file_name": file_name, "chunks": 0, "embedding_time": 0.0, "from_store": False, "error": str(error)}
 
-def process_uploaded_pdf(uploaded_file, embeddings):
-    """Process uploaded PDF and create vector database"""
+def process_uploaded_pdf(uploaded_file, embeddings, progress_callback=None):
+    """Process uploaded PDF and create vector database, reusing the stored copy if present.
+    
+    The PDF is read from memory and streamed page by page: chunks are embedded in batches
+    of INGEST_EMBED_BATCH_SIZE and appended to the index as they are produced.
+    progress_callback, if given, receives a dict per page and per embedded batch.
+    """
     try:
-       # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            tmp_file.write(uploaded_file.getvalue())
-            tmp_file_path = tmp_file.name
-        
-        # Load PDF
-        loader = PyPDFLoader(tmp_file_path)
-        documents = loader.load()
-        
-        # Split documents
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=100,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
+        file_bytes = uploaded_file.getvalue()
+        kb_key = pdf_kb_key(file_bytes, embeddings)
+        
+        # Same file, model and chunking seen before - load instead of re-embedding
+        stored = load_stored_pdf(uploaded_file.name, kb_key, embeddings)
+        if stored is not None:
+            return stored
+        
+        # Each chunk is embedded exactly once, a batch at a time
+        vector_db, doc_chunks, embed_time = embed_chunk_stream(
+            stream_pdf_chunks(file_bytes, uploaded_file.name, progress_callback),
+            embeddings,
+            progress_callback=progress_callback,
+            source=uploaded_file.name
         )
         
-        doc_chunks = text_splitter.split_documents(documents)
+        if not doc_chunks:
+            return None, None, {"file_name": uploaded_file.name, "chunks": 0, "embedding_time": 0.0, "from_store": False}
         
-        # Create vector database
-        vector_db = FAISS.from_documents(doc_chunks, embeddings)
+        save_knowledge_base(kb_key, vector_db, embeddings, name=uploaded_file.name)
         
-        # Clean up temporary file
-        os.unlink(tmp_file_path)
+        file_stats = {
+            "file_name": uploaded_file.name,
+            "chunks": len(doc_chunks),
+            "embedding_time": round(embed_time, 3),
+            "from_store": False
+        }
         
-        return vector_db, doc_chunks
+        return vector_db, doc_chunks, file_stats
         
     except Exception as e:
         st.error(f"Error processing PDF: {e}")
-        return None, None
+        return None, None, failed_file_stats(uploaded_file.name, e)
+
+def parse_pdfs_in_pool(pending, workers, progress_callback=None):
+    """Parse and split PDFs in worker processes; (chunks, parse_time) or the exception, per file.
+    
+    Text extraction and splitting are pure Python, so threads would serialize on the GIL.
+    Workers are spawned rather than forked: forking a process that holds model threads is unsafe.
+    """
+    results, retry = {}, []
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(pending)), mp_context=context) as executor:
+        futures = {
+            executor.submit(parse_pdf, file_bytes, uploaded_file.name): i
+            for i, (uploaded_file, file_bytes, _) in enumerate(pending)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except BrokenProcessPool:
+                # A worker died (or could not start) - not this file's fault, so parse it here instead
+                retry.append(i)
+                continue
+            except Exception as e:
+                results[i] = e
+            if progress_callback:
+                progress_callback({
+                    "file_name": pending[i][0].name,
+                    "stage": "parsed",
+                    "files_done": len(results),
+                    "files": len(pending)
+                })
+    for i in retry:
+        uploaded_file, file_bytes, _ = pending[i]
+        try:
+            results[i] = parse_pdf(file_bytes, uploaded_file.name)
+        except Exception as e:
+            results[i] = e
+    return [results[i] for i in range(len(pending))]
+
+def embed_parsed_pdfs(parsed, embeddings, progress_callback=None):
+    """One batched embedding pass over the chunks of every parsed file.
+    
+    Batches span file boundaries, so small files do not each pay for a part-filled batch.
+    Returns the vectors of each file, in order, and the total embedding time.
+    """
+    chunks = [chunk for file_chunks in parsed for chunk in file_chunks]
+    vectors, embed_time = [], 0.0
+    for start in range(0, len(chunks), INGEST_EMBED_BATCH_SIZE):
+        texts = [chunk.page_content for chunk in chunks[start:start + INGEST_EMBED_BATCH_SIZE]]
+        embed_start_time = time.time()
+        vectors.extend(embeddings.embed_documents(texts))
+        embed_time += time.time() - embed_start_time
+        if progress_callback:
+            progress_callback({"file_name": None, "stage": "batch", "embedded": len(vectors), "total": len(chunks)})
+    
+    file_vectors, offset = [], 0
+    for file_chunks in parsed:
+        file_vectors.append(vectors[offset:offset + len(file_chunks)])
+        offset += len(file_chunks)
+    return file_vectors, embed_time
+
+def ingest_pdf_files(uploaded_files, embeddings, progress_callback=None, workers=INGEST_WORKERS):
+    """(vector_db, chunks, stats) per uploaded PDF, in upload order.
+    
+    Files stored before are loaded. When more than one file is new, they are parsed in a
+    process pool and all their chunks go through a single batched embedding stage; a lone
+    new file is streamed page by page instead. A file that fails is reported in its stats
+    ("error") without stopping the others.
+    """
+    workers = workers or os.cpu_count() or 1
+    results = []
+    pending = []
+    
+    for uploaded_file in uploaded_files:
+        try:
+            file_bytes = uploaded_file.getvalue()
+            kb_key = pdf_kb_key(file_bytes, embeddings)
+            stored = load_stored_pdf(uploaded_file.name, kb_key, embeddings)
+        except Exception as e:
+            results.append((None, None, failed_file_stats(uploaded_file.name, e)))
+            continue
+        if stored is not None:
+            results.append(stored)
+        else:
+            pending.append((uploaded_file, file_bytes, kb_key))
+            results.append(None)
+    
+    if len(pending) > 1 and workers > 1:
+        new_results = ingest_in_parallel(pending, embeddings, workers, progress_callback)
+    else:
+        new_results = [process_uploaded_pdf(uploaded_file, embeddings, progress_callback) for uploaded_file, _, _ in pending]
+    # Keep upload order
+    new_results = iter(new_results)
+    return [result if result is not None else next(new_results) for result in results]
+
+def ingest_uploaded_pdfs(uploaded_files, embeddings, progress_callback=None, workers=INGEST_WORKERS):
+    """Process uploaded PDFs and merge their vectors into a single knowledge base"""
+    vector_dbs = []
+    all_chunks = []
+    file_stats = []
+    for vector_db, chunks, stats in ingest_pdf_files(uploaded_files, embeddings, progress_callback, workers):
+        if stats:
+            file_stats.append(stats)
+        if chunks:
+            vector_dbs.append(vector_db)
+            all_chunks.extend(chunks)
+    
+    if not vector_dbs:
+        return None, [], file_stats
+    
+    return merge_vector_dbs(vector_dbs, embeddings), all_chunks, file_stats
+
+def ingest_in_parallel(pending, embeddings, workers, progress_callback=None):
+    """(vector_db, chunks, stats) per pending file: parse in a process pool, then embed once"""
+    parsed = parse_pdfs_in_pool(pending, workers, progress_callback)
+    ok = [i for i, result in enumerate(parsed) if not isinstance(result, Exception)]
+    results = [(None, None, failed_file_stats(pending[i][0].name, result)) if isinstance(result, Exception) else None
+               for i, result in enumerate(parsed)]
+    
+    try:
+        file_vectors, embed_time = embed_parsed_pdfs([parsed[i][0] for i in ok], embeddings, progress_callback)
+    except Exception as e:
+        st.error(f"Error embedding PDFs: {e}")
+        for i in ok:
+            results[i] = (None, None, failed_file_stats(pending[i][0].name, e))
+        return results
+    
+    total_chunks = sum(len(parsed[i][0]) for i in ok)
+    for i, vectors in zip(ok, file_vectors):
+        uploaded_file, _, kb_key = pending[i]
+        doc_chunks, parse_time = parsed[i]
+        stats = {
+            "file_name": uploaded_file.name,
+            "chunks": len(doc_chunks),
+            "parse_time": parse_time,
+            # Batches mix files, so each file is charged its share of the chunks embedded
+            "embedding_time": round(embed_time * len(doc_chunks) / total_chunks, 3) if total_chunks else 0.0,
+            "from_store": False
+        }
+        if not doc_chunks:
+            results[i] = (None, None, stats)
+            continue
+        try:
+            vector_db = FAISS.from_embeddings(
+                list(zip((chunk.page_content for chunk in doc_chunks), vectors)),
+                embeddings,
+                metadatas=[chunk.metadata for chunk in doc_chunks]
+            )
+            index_keywords(vector_db)
+            save_knowledge_base(kb_key, vector_db, embeddings, name=uploaded_file.name)
+            results[i] = (vector_db, doc_chunks, stats)
+        except Exception as e:
+            results[i] = (None, None, failed_file_stats(uploaded_file.name, e))
+    return results
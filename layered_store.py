@@ -0,0 +1,106 @@
+import copy
+import heapq
+import hashlib
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.faiss import dependable_faiss_import
+from kb_store import get_kb_version
+from lexical_index import get_lexical_index, attach_lexical_index
+
+
+class LayeredVectorStore:
+    """Shared read-only vector databases plus a per-session layer, searched as one.
+
+    Shared layers (e.g. the default knowledge base) are held by reference and never modified,
+    so N sessions do not mean N copies of their vectors; a session's own uploads live in a
+    separate, small index. Every layer is searched and the hits are merged by distance - all
+    layers come from the same embedding model. Chunks of shared documents removed in one
+    session are hidden for that session instead of deleted.
+    """
+
+    def __init__(self, shared_dbs: list, embeddings, session_db=None):
+        self.shared_dbs = list(shared_dbs)
+        self.session_db = session_db
+        self.embedding_function = embeddings
+        self.hidden_ids = set()
+        self._version = None
+
+    @property
+    def layers(self) -> list:
+        return self.shared_dbs + ([self.session_db] if self.session_db is not None else [])
+
+    @property
+    def ntotal(self) -> int:
+        return sum(layer.index.ntotal for layer in self.layers) - len(self.hidden_ids)
+
+    def copy(self):
+        """A store over the same shared layers with its own copy of the session layer.
+
+        Changes to the copy (e.g. through a DocumentRegistry) do not touch this store, so
+        searches running on it are unaffected until the copy is swapped in.
+        """
+        session_db = self.session_db
+        if session_db is not None:
+            faiss = dependable_faiss_import()
+            session_db = FAISS(
+                self.embedding_function,
+                faiss.clone_index(session_db.index),
+                InMemoryDocstore(dict(session_db.docstore._dict)),
+                dict(session_db.index_to_docstore_id)
+            )
+            lexical_index = get_lexical_index(self.session_db, build=False)
+            if lexical_index is not None:
+                attach_lexical_index(session_db, copy.deepcopy(lexical_index))
+        store = LayeredVectorStore(self.shared_dbs, self.embedding_function, session_db)
+        store.hidden_ids = set(self.hidden_ids)
+        return store
+
+    def similarity_search_with_score_by_vector(self, embedding, k: int = 4, **kwargs) -> list:
+        hits = []
+        for layer in self.layers:
+            if not layer.index.ntotal:
+                continue
+            # Over-fetch by the number of hidden chunks so k visible hits can remain
+            fetch_k = min(k + len(self.hidden_ids), layer.index.ntotal)
+            hits.extend(
+                (doc, score)
+                for doc, score in layer.similarity_search_with_score_by_vector(embedding, k=fetch_k, **kwargs)
+                if doc.id not in self.hidden_ids
+            )
+        # Scores are L2 distances: smaller is closer
+        return heapq.nsmallest(k, hits, key=lambda hit: hit[1])
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs) -> list:
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs) -> list:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def lexical_search(self, query: str, k: int = 4) -> list:
+        """Top-k (document, BM25 score) pairs over all layers, hidden chunks left out"""
+        hits = []
+        for layer in self.layers:
+            if not layer.index.ntotal:
+                continue
+            hits.extend(
+                (layer.docstore.search(doc_id), score)
+                for doc_id, score in get_lexical_index(layer).search(query, k + len(self.hidden_ids))
+                if doc_id not in self.hidden_ids
+            )
+        # Each layer scores with its own term statistics; close enough to merge on
+        return heapq.nlargest(k, hits, key=lambda hit: hit[1])
+
+    def kb_version(self) -> str:
+        """Version of the combined contents, from the versions of the layers and the hidden chunks"""
+        if self._version is None:
+            version_hash = hashlib.sha256()
+            for layer in self.layers:
+                version_hash.update(get_kb_version(layer).encode("utf-8"))
+            for hidden_id in sorted(self.hidden_ids):
+                version_hash.update(hidden_id.encode("utf-8"))
+            self._version = version_hash.hexdigest()[:16]
+        return self._version
+
+    def invalidate(self):
+        """Call after changing the session layer or the hidden chunks"""
+        self._version = None
@@ -0,0 +1,305 @@
+"""BM25 keyword index kept next to each FAISS vector database.
+
+Dense retrieval scores exact tokens - names, certification titles, IDs - poorly, so chunks
+are also indexed by their terms and the two rankings are fused (see retrieval). Postings
+are flat `array('I')` buffers, one 32-bit word per (chunk slot, term frequency) posting:
+compact, appendable as chunks are ingested, and scored with numpy without copying. Removed chunks are
+tombstoned and the postings compacted once enough of them pile up.
+
+    python lexical_index.py --synthetic 100000    # query latency and memory
+"""
+import re
+import os
+import sys
+import math
+import time
+import random
+import argparse
+import threading
+import weakref
+from array import array
+import numpy as np
+
+# Set to 0 to search the vector index alone
+LEXICAL_SEARCH = os.getenv("LEXICAL_SEARCH", "1") not in ("0", "false", "no")
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+# Compact the postings once this share of the indexed chunks has been removed
+_COMPACT_DEAD_FRACTION = 0.25
+_AVERAGE_LENGTH_DRIFT = 0.1
+# A posting is slot << 8 | term frequency (capped at 255): up to 16.7M chunks per index
+_TF_BITS = 8
+_TF_MASK = (1 << _TF_BITS) - 1
+
+# Words with inner '-', '.' or '/' (AZ-900, v2.1, TCP/IP) stay whole and are indexed by their parts too
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+_PART_PATTERN = re.compile(r"[-./]")
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have he her his how i if in into is it
+its me my no not of on or our she so than that the their them then there these they this to too us was we were
+what when where which who whom why will with would you your
+""".split())
+
+
+def tokenize(text: str) -> list:
+    """Lowercased terms of a text, stopwords dropped"""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if _PART_PATTERN.search(token):
+            terms.extend(part for part in _PART_PATTERN.split(token) if part and part not in STOPWORDS)
+    return terms
+
+
+class LexicalIndex:
+    """Incremental BM25 inverted index over chunks identified by their docstore ids"""
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}         # term -> array('I') of slot << 8 | tf
+        self.ids = []              # slot -> docstore id, None once removed
+        self.slots = {}            # docstore id -> slot
+        self.lengths = array("I")  # slot -> number of terms, 0 once removed
+        self.removed_slots = array("I")
+        self.total_length = 0
+        self._norms = None
+        # Length normalization uses an average that is only refreshed when it drifts, so the
+        # per-term impacts cached for queried terms stay valid as chunks are added
+        self._average_length = None
+        self._impacts = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state.update(_norms=None, _average_length=None, _impacts={})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def add(self, ids: list, texts: list):
+        """Index chunks; an id already present is replaced"""
+        with self._lock:
+            self._remove([doc_id for doc_id in ids if doc_id in self.slots])
+            for doc_id, text in zip(ids, texts):
+                slot = len(self.ids)
+                term_counts = {}
+                for term in tokenize(text):
+                    term_counts[term] = term_counts.get(term, 0) + 1
+                for term, count in term_counts.items():
+                    postings = self.postings.get(term)
+                    if postings is None:
+                        postings = self.postings[term] = array("I")
+                    postings.append(slot << _TF_BITS | min(count, _TF_MASK))
+                length = sum(term_counts.values())
+                self.ids.append(doc_id)
+                self.slots[doc_id] = slot
+                self.lengths.append(length)
+                self.total_length += length
+            self._norms = None
+
+    def remove(self, ids) -> int:
+        """Drop chunks by docstore id; returns how many were indexed"""
+        with self._lock:
+            removed = self._remove(ids)
+            if len(self.ids) and (len(self.ids) - len(self.slots)) / len(self.ids) > _COMPACT_DEAD_FRACTION:
+                self._compact()
+            return removed
+
+    def _remove(self, ids) -> int:
+        removed = 0
+        for doc_id in ids:
+            slot = self.slots.pop(doc_id, None)
+            if slot is None:
+                continue
+            self.ids[slot] = None
+            self.total_length -= self.lengths[slot]
+            self.lengths[slot] = 0
+            self.removed_slots.append(slot)
+            removed += 1
+        if removed:
+            self._norms = None
+        return removed
+
+    def _compact(self):
+        """Renumber live chunks and drop tombstoned postings"""
+        alive = np.frombuffer(self.lengths, dtype=np.uint32) > 0
+        new_slots = (np.cumsum(alive) - 1).astype(np.uint32)
+        for term in list(self.postings):
+            postings = np.frombuffer(self.postings[term], dtype=np.uint32)
+            postings = postings[alive[postings >> _TF_BITS]]
+            if not len(postings):
+                del self.postings[term]
+                continue
+            postings = new_slots[postings >> _TF_BITS] << _TF_BITS | (postings & _TF_MASK)
+            self.postings[term] = array("I", postings.astype(np.uint32).tobytes())
+        self.lengths = array("I", np.frombuffer(self.lengths, dtype=np.uint32)[alive].tobytes())
+        self.ids = [doc_id for doc_id in self.ids if doc_id is not None]
+        self.removed_slots = array("I")
+        self.slots = {doc_id: slot for slot, doc_id in enumerate(self.ids)}
+        self._norms = None
+        self._impacts.clear()
+
+    def _length_norms(self) -> np.ndarray:
+        # k1 * (1 - b + b * length / average length) per slot
+        if self._norms is None or len(self._norms) != len(self.lengths):
+            average_length = self.total_length / len(self.slots) if self.slots else 1.0
+            if not self._average_length or abs(average_length / self._average_length - 1) > _AVERAGE_LENGTH_DRIFT:
+                self._average_length = max(average_length, 1.0)
+                self._impacts.clear()
+            lengths = np.frombuffer(self.lengths, dtype=np.uint32).astype(np.float32)
+            self._norms = self.k1 * (1 - self.b + self.b * lengths / self._average_length)
+        return self._norms
+
+    def _term_impacts(self, term: str, postings: np.ndarray) -> np.ndarray:
+        """tf * (k1 + 1) / (tf + norm) per posting, cached; postings appended since are added on"""
+        impacts = self._impacts.get(term)
+        done = len(impacts) if impacts is not None else 0
+        if done < len(postings):
+            norms = self._length_norms()
+            tfs = (postings[done:] & _TF_MASK).astype(np.float32)
+            new_impacts = tfs * (self.k1 + 1) / (tfs + norms[postings[done:] >> _TF_BITS])
+            impacts = new_impacts if impacts is None else np.concatenate([impacts, new_impacts])
+            self._impacts[term] = impacts
+        return impacts
+
+    def search(self, query: str, k: int = 4) -> list:
+        """Top-k (docstore id, BM25 score) pairs, best first"""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not self.slots or not terms:
+                return []
+            self._length_norms()
+            num_docs = len(self.slots)
+            slots, weights = [], []
+            for term in terms:
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                postings = np.frombuffer(postings, dtype=np.uint32)
+                # Removed chunks still count towards df until compaction; a close enough estimate
+                df = min(len(postings), num_docs)
+                idf = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+                slots.append(postings >> _TF_BITS)
+                weights.append(np.float32(idf) * self._term_impacts(term, postings))
+            if not slots:
+                return []
+            scores = np.bincount(np.concatenate(slots), np.concatenate(weights), minlength=len(self.ids))
+            if self.removed_slots:
+                scores[np.frombuffer(self.removed_slots, dtype=np.uint32)] = 0
+            top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+            top = top[scores[top] > 0]
+            top = top[np.argsort(-scores[top], kind="stable")]
+            return [(self.ids[slot], float(scores[slot])) for slot in top]
+
+    def memory_bytes(self) -> int:
+        """Bytes held by the postings and per-chunk arrays (excluding the id strings)"""
+        return sum(postings.itemsize * len(postings) for postings in self.postings.values()) + \
+            self.lengths.itemsize * len(self.lengths)
+
+
+_lexical_indexes = weakref.WeakKeyDictionary()
+_lexical_indexes_lock = threading.Lock()
+
+
+def attach_lexical_index(vector_db, lexical_index: LexicalIndex):
+    """Use a prebuilt (e.g. stored) lexical index for a vector database"""
+    _lexical_indexes[vector_db] = lexical_index
+
+
+def get_lexical_index(vector_db, build: bool = True):
+    """The lexical index of a FAISS vector database, built or caught up from its docstore.
+
+    Chunks appended since the last call (add_embeddings during ingestion) are indexed
+    incrementally; removals must go through LexicalIndex.remove. With build=False only an
+    index that already exists is returned, else None.
+    """
+    with _lexical_indexes_lock:
+        lexical_index = _lexical_indexes.get(vector_db)
+        if lexical_index is None:
+            if not build:
+                return None
+            lexical_index = _lexical_indexes[vector_db] = LexicalIndex()
+    if not build:
+        return lexical_index
+    index_to_docstore_id = vector_db.index_to_docstore_id
+    size = len(index_to_docstore_id)
+    indexed = len(lexical_index)
+    if indexed != size:
+        if indexed > size or (indexed and index_to_docstore_id[indexed - 1] not in lexical_index.slots):
+            # Changed other than by appending: start over
+            with _lexical_indexes_lock:
+                lexical_index = _lexical_indexes[vector_db] = LexicalIndex()
+            indexed = 0
+        ids = [index_to_docstore_id[i] for i in range(indexed, size)]
+        lexical_index.add(ids, [vector_db.docstore.search(doc_id).page_content for doc_id in ids])
+    return lexical_index
+
+
+def index_keywords(vector_db):
+    """Bring the keyword index of a vector database up to date with its chunks, unless disabled"""
+    if LEXICAL_SEARCH:
+        get_lexical_index(vector_db)
+
+
+def lexical_search(vector_db, query: str, k: int = 4) -> list:
+    """Top-k (document, BM25 score) pairs of a FAISS vector database or a layered store"""
+    if hasattr(vector_db, "lexical_search"):
+        return vector_db.lexical_search(query, k)
+    return [
+        (vector_db.docstore.search(doc_id), score)
+        for doc_id, score in get_lexical_index(vector_db).search(query, k)
+    ]
+
+
+def synthetic_corpus(count: int, words: int = 160, vocabulary: int = 200000, seed: int = 0) -> list:
+    """Chunks of Zipf-distributed words, roughly English term statistics once the ~100 most
+    frequent (stopword-like) ranks are left out, as tokenize does"""
+    rng = np.random.default_rng(seed)
+    ranks = np.empty(0, dtype=np.int64)
+    while len(ranks) < count * words:
+        sample = rng.zipf(1.1, size=count * words)
+        ranks = np.concatenate([ranks, sample[(sample > 100) & (sample <= vocabulary)]])
+    ranks = ranks[:count * words].reshape(count, words)
+    return [" ".join(f"w{rank}" for rank in row) for row in ranks]
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Build time, memory and query latency of the BM25 lexical index")
+    parser.add_argument("--synthetic", type=int, default=100000, help="number of synthetic chunks")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    texts = synthetic_corpus(args.synthetic)
+    lexical_index = LexicalIndex()
+    start = time.perf_counter()
+    lexical_index.add([str(i) for i in range(len(texts))], texts)
+    build_time = time.perf_counter() - start
+
+    # Queries mix a few words of a random chunk, like a question about it
+    rng = random.Random(0)
+    queries = [" ".join(rng.sample(texts[rng.randrange(len(texts))].split(), 5)) for _ in range(args.queries)]
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        lexical_index.search(query, args.k)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+    print(f"{len(lexical_index)} chunks, {len(lexical_index.postings)} terms, "
+          f"{lexical_index.memory_bytes() / 2 ** 20:.1f} MB postings, built in {build_time:.1f}s")
+    print(f"query latency: mean {latencies.mean():.3f} ms, p50 {np.percentile(latencies, 50):.3f} ms, "
+          f"p95 {np.percentile(latencies, 95):.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
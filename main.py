@@ -1,12 +1,25 @@
+import time
 import streamlit as st
+from startup import start_warmup, get_startup_report
+app_imports_started = time.perf_counter()
 from utils import get_api_keys, initialize_base_components,FAISS
 from css import apply_custom_css
 from knowledge_base import *
+from kb_store import list_knowledge_bases, delete_knowledge_base
 from question_generation import generate_dynamic_questions
-import time
-from pipelines import traditional_rag_query_enhanced, agentic_rag_query_enhanced
-from visualization import create_processing_steps_visual, create_pipeline_visualization
+import json
+from pipelines import run_pipelines, get_speculative_search_stats
+from retrieval import RetrievalContext
+from vector_index import describe_index, index_memory_bytes
+from document_registry import DocumentRegistry, content_doc_id
+from layered_store import LayeredVectorStore
+from web_cache import get_web_cache
+from answer_cache import get_answer_cache
+from routing import get_router_stats
+from visualization import create_trace_waterfall, create_pipeline_visualization
+from tracing import to_chrome_trace
 from header import *
+get_startup_report().record_once("app_imports", app_imports_started)
 
 
 if 'initialized' not in st.session_state:
@@ -19,21 +32,52 @@ if 'initialized' not in st.session_state:
 
 
 
+def load_components():
+    """Take the warmed-up models and default knowledge base into the session, waiting if they are still loading"""
+    llm, embeddings = initialize_base_components()
+    if llm and embeddings:
+        try:
+            vector_db = session_knowledge_base(embeddings)
+        except Exception as e:
+            st.error(f"Error loading default knowledge base: {e}")
+            # The failed warm-up is cached; drop it so the next rerun starts a fresh one
+            start_warmup.clear()
+            return False
+        st.session_state.llm = llm
+        st.session_state.embeddings = embeddings
+        st.session_state.vector_db = vector_db
+        st.session_state.components_loaded = True
+    return st.session_state.components_loaded
+
+
+def session_knowledge_base(embeddings):
+    """The process-wide default knowledge base (shared by reference) with an empty layer for this session's uploads"""
+    default_db = start_warmup().default_knowledge_base()
+    return LayeredVectorStore([default_db] if default_db is not None else [], embeddings)
+
+
+def get_document_registry():
+    """The session's document registry over its current knowledge base"""
+    registry = st.session_state.get("document_registry")
+    if registry is None or registry.vector_db is not st.session_state.vector_db:
+        registry = DocumentRegistry(st.session_state.vector_db, st.session_state.embeddings)
+        st.session_state.document_registry = registry
+    return registry
+
+
 def main():
     """Enhanced main Streamlit application"""
+    render_started = time.perf_counter()
+    # Models load on a background thread while the page renders
+    warmup = start_warmup()
     apply_custom_css()
     # Header
     st.markdown('<div class="main-header">🤖 Agentic RAG : AI and SEARCH (in development)</div>', unsafe_allow_html=True)
     
     get_steps()
 
-    if not st.session_state.components_loaded:
-        llm, embeddings = initialize_base_components()
-        if llm and embeddings:
-            st.session_state.llm = llm
-            st.session_state.embeddings = embeddings
-            st.session_state.components_loaded = True
-            st.session_state.vector_db = create_default_knowledge_base(st.session_state.embeddings) 
+    if not st.session_state.components_loaded and warmup.ready:
+        load_components()
 
     
     # Sidebar
@@ -51,24 +95,69 @@ def main():
         if uploaded_files and st.button("🚀 Process & Train", type="primary"):
             with st.spinner("Processing uploaded documents..."):
                 # Initialize base components if not already done
-                if not st.session_state.components_loaded:
-                    llm, embeddings = initialize_base_components()
-                    if llm and embeddings:
-                        st.session_state.llm = llm
-                        st.session_state.embeddings = embeddings
-                        st.session_state.components_loaded = True
+                if not st.session_state.components_loaded and not load_components():
+                    st.stop()
             
-            # Process uploaded PDFs
-            all_chunks = []
+            # Per-page (or per-file, when parsed in parallel) and per-batch progress
+            progress_bar = st.progress(0.0, text="Reading PDFs...")
+            progress_state = {"fraction": 0.0, "page": ""}
+            def report_progress(event):
+                if event["stage"] == "page":
+                    progress_state["fraction"] = event["page"] / event["pages"]
+                    progress_state["page"] = f"{event['file_name']}: page {event['page']}/{event['pages']}"
+                    progress_bar.progress(progress_state["fraction"], text=progress_state["page"])
+                elif event["stage"] == "parsed":
+                    progress_state["page"] = f"Parsed {event['files_done']}/{event['files']} files"
+                    progress_bar.progress(event["files_done"] / event["files"], text=progress_state["page"])
+                elif "total" in event:
+                    progress_bar.progress(event["embedded"] / event["total"], text=f"Embedded {event['embedded']}/{event['total']} chunks")
+                else:
+                    progress_bar.progress(progress_state["fraction"], text=f"{progress_state['page']} - {event['embedded']} chunks embedded")
+
+            # Uploads are added to the session's knowledge base in place; files already in it are skipped
+            registry = get_document_registry()
+            new_files = []
             for uploaded_file in uploaded_files:
-                st.write(f"Processing: {uploaded_file.name}")
-                vector_db, chunks = process_uploaded_pdf(uploaded_file, st.session_state.embeddings)
-                if chunks:
-                    all_chunks.extend(chunks)
+                doc_id = content_doc_id(uploaded_file.getvalue())
+                if registry.has(doc_id):
+                    st.write(f"Skipped: {uploaded_file.name} - already in the knowledge base")
+                else:
+                    new_files.append((uploaded_file, doc_id))
             
+            # Each new chunk is embedded once and appended to the index
+            all_chunks, file_stats = [], []
+            file_results = ingest_pdf_files([uploaded_file for uploaded_file, _ in new_files], st.session_state.embeddings, report_progress)
+            for (uploaded_file, doc_id), (file_db, chunks, stats) in zip(new_files, file_results):
+                if stats:
+                    file_stats.append(stats)
+                if chunks and registry.add_vector_db(doc_id, uploaded_file.name, file_db) is not None:
+                    all_chunks.extend(chunks)
+            vector_db = registry.vector_db
+            progress_bar.empty()
+            for stats in file_stats:
+                if stats.get('error'):
+                    st.warning(f"Failed: {stats['file_name']} - {stats['error']}")
+                elif stats.get('from_store'):
+                    st.write(f"Loaded: {stats['file_name']} - {stats['chunks']} chunks from stored knowledge base")
+                elif 'parse_time' in stats:
+                    st.write(f"Processed: {stats['file_name']} - {stats['chunks']} chunks, {stats['parse_time']:.2f}s parsing, {stats['embedding_time']:.2f}s embedding")
+                else:
+                    st.write(f"Processed: {stats['file_name']} - {stats['chunks']} chunks, {stats['embedding_time']:.2f}s embedding")
+            if hasattr(st.session_state.embeddings, "get_stats"):
+                cache_stats = st.session_state.embeddings.get_stats()
+                st.caption(f"Embedding cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses ({cache_stats['hit_rate']:.0%} hit rate)")
+
             if all_chunks:
-                # Create combined vector database
-                st.session_state.vector_db = FAISS.from_documents(all_chunks, st.session_state.embeddings)
+                # Uploads live in the session's own index, searched together with the shared base
+                session_index = vector_db.session_db.index
+                index_info = describe_index(session_index)
+                index_params = ", ".join(f"{key}={value}" for key, value in index_info.items() if key not in ("type", "class", "ntotal", "storage", "refine"))
+                index_storage = index_info["storage"] + (f" + {index_info['refine']} re-scoring" if index_info["refine"] != "none" else "")
+                st.caption(f"Session index: {index_info['type'].upper()} over {index_info['ntotal']} chunks, {index_storage} vectors, "
+                           f"{index_memory_bytes(session_index) / 2 ** 20:.1f} MB" + (f" ({index_params})" if index_params else "")
+                           + f" · searched with {vector_db.ntotal - index_info['ntotal']} shared chunks")
+                # Use the updated vector database
+                st.session_state.vector_db = vector_db
                 st.session_state.custom_docs_loaded = True
                 st.session_state.current_knowledge_base = "custom"
                 
@@ -100,6 +189,85 @@ def main():
                     else:
                         # st.error("❌ No valid text chunks extracted from uploaded PDFs.")   
                         pass
+        if st.session_state.components_loaded:
+            with st.expander("#### 📚 Documents in this Session"):
+                registry = get_document_registry()
+                for doc in registry.list_documents():
+                    st.markdown(f"**{doc['name']}** - {doc['chunks']} chunks" + (" (shared)" if doc['layer'] == "shared" else ""))
+                    st.caption(doc['doc_id'])
+                    if st.button("🗑️ Remove", key=f"remove_doc_{doc['doc_id']}"):
+                        registry.remove_document(doc['doc_id'])
+                        st.session_state.vector_db = registry.vector_db
+                        st.rerun()
+
+        with st.expander("#### 🗄️ Stored Knowledge Bases"):
+            stored_kbs = list_knowledge_bases()
+            if not stored_kbs:
+                st.info("No stored knowledge bases yet")
+            for kb in stored_kbs:
+                st.markdown(f"**{kb['name']}** - {kb['num_vectors']} chunks, {kb['size_bytes'] / 1024:.0f} KB")
+                st.caption(f"{kb['embedding_model']} · {kb['key'][:12]}")
+                if st.button("🗑️ Delete", key=f"delete_kb_{kb['key']}"):
+                    delete_knowledge_base(kb['key'])
+                    st.rerun()
+
+        st.markdown("### ⚙️ Performance")
+        run_concurrently = st.toggle(
+            "⚡ Run pipelines concurrently",
+            value=True,
+            help="Start Traditional and Agentic RAG together; the wait is roughly the slower of the two"
+        )
+        stream_answers = st.toggle(
+            "📡 Stream answers",
+            value=True,
+            help="Show the Agentic RAG answer token by token while it is generated"
+        )
+        speculative_web = st.toggle(
+            "🔮 Speculative web search",
+            value=False,
+            help="Start the web search while the router decides; discarded if the route is LOCAL"
+        )
+        fast_router = st.toggle(
+            "🎯 Fast-path router",
+            value=True,
+            help="Decide LOCAL/WEB from retrieval scores when the answer is obvious; the LLM router handles the rest"
+        )
+        router_stats = get_router_stats()
+        st.caption(f"Routing decisions: {router_stats['fast-path']} fast-path / {router_stats['llm']} LLM")
+        semantic_cache = st.toggle(
+            "🧠 Semantic answer cache",
+            value=False,
+            help="Reuse the Agentic RAG answer to a near-identical earlier question on the same knowledge base, for up to ANSWER_CACHE_TTL seconds"
+        )
+        if semantic_cache:
+            answer_cache_stats = get_answer_cache().get_stats()
+            st.caption(
+                f"Answer cache: {answer_cache_stats['hits']} hits / {answer_cache_stats['misses']} misses, "
+                f"{answer_cache_stats['entries']} answers stored"
+            )
+            if st.button("🧹 Clear answer cache"):
+                get_answer_cache().invalidate()
+        web_cache_stats = get_web_cache().get_stats()
+        st.caption(
+            f"Web cache: {web_cache_stats['hits']} hits / {web_cache_stats['misses']} misses "
+            f"({web_cache_stats['hit_rate']:.0%} hit rate)"
+        )
+        if speculative_web:
+            spec_stats = get_speculative_search_stats()
+            st.caption(
+                f"Speculative searches: {spec_stats['used']} used / {spec_stats['wasted']} wasted / "
+                f"{spec_stats['cancelled']} cancelled · {spec_stats['time_saved']:.1f}s saved, "
+                f"{spec_stats['time_wasted']:.1f}s of searches discarded"
+            )
+
+        with st.expander("🚀 Startup"):
+            if not warmup.ready:
+                st.info("Models are loading in the background - the first question waits for them")
+            elif warmup.error is None:
+                st.caption(f"Ready to answer {warmup.ready_after:.1f}s after start")
+            for phase in get_startup_report().to_dict()["phases"]:
+                st.caption(f"{phase['name']}: {phase['duration']:.2f}s (at {phase['start']:.2f}s, {phase['thread']})")
+
         get_traditional_rags_desc()
         get_agentic_rags_desc()
         # with st.expander("### 🔑 API Configuration"):
@@ -132,21 +300,38 @@ def main():
 
     if process_query and query:
         st.markdown("---")
-        if not st.session_state.vector_db :
-            st.session_state.vector_db = create_default_knowledge_base(st.session_state.embeddings)           
-        # Process both systems
+        if not st.session_state.components_loaded:
+            with st.spinner("Waiting for the models to finish loading..."):
+                if not load_components():
+                    return
+        if not st.session_state.get('vector_db'):
+            st.session_state.vector_db = session_knowledge_base(st.session_state.embeddings)
+        # Process both systems - one query embedding and search shared by both
+        retrieval_context = RetrievalContext(st.session_state.vector_db, query)
+        # Live answer area - tokens are written here as they arrive, then replaced by the full results
+        stream_placeholder = st.empty()
         with st.spinner("Processing with both RAG systems..."):
-            traditional_result = traditional_rag_query_enhanced(
-                st.session_state.llm, 
-                st.session_state.vector_db, 
-                query
-            )
-            
-            agentic_result = agentic_rag_query_enhanced(
+            traditional_result, agentic_result, pipeline_timings = run_pipelines(
                 st.session_state.llm,
                 st.session_state.vector_db,
-                query
+                query,
+                retrieval_context=retrieval_context,
+                concurrent=run_concurrently,
+                speculative_web=speculative_web,
+                semantic_cache=semantic_cache,
+                fast_router=fast_router,
+                stream_callback=stream_placeholder.markdown if stream_answers else None
             )
+        stream_placeholder.empty()
+        
+        # Per-pipeline timings
+        col_t1, col_t2, col_t3 = st.columns(3)
+        with col_t1:
+            st.metric("Traditional RAG", f"{pipeline_timings['traditional']:.2f}s")
+        with col_t2:
+            st.metric("Agentic RAG", f"{pipeline_timings['agentic']:.2f}s")
+        with col_t3:
+            st.metric("Wall Clock" + (" (concurrent)" if pipeline_timings['concurrent'] else ""), f"{pipeline_timings['wall_clock']:.2f}s")
         
         # Display results in two columns
         
@@ -164,11 +349,19 @@ def main():
             route_class = "hybrid-route"
         st.markdown(f'<div class="routing-decision {route_class}">{agentic_result["route_decision"]} Route</div>', unsafe_allow_html=True)
         st.success(agentic_result["routing_explanation"])
+        if agentic_result.get("semantic_cache", {}).get("hit"):
+            cache_info = agentic_result["semantic_cache"]
+            st.info(f"⚡ Answered from semantic cache - similar to \"{cache_info['matched_query']}\" (similarity {cache_info['similarity']:.3f})")
         
-        # Processing steps
+        # Per-stage timing waterfall (hover a row for its attributes)
         st.markdown("**Processing Pipeline:**")
-        steps_html = create_processing_steps_visual(agentic_result["processing_steps"], "agentic")
-        st.markdown(steps_html, unsafe_allow_html=True)
+        st.markdown(create_trace_waterfall(agentic_result["trace"]), unsafe_allow_html=True)
+        st.download_button(
+            "⬇️ Download trace (chrome://tracing / Perfetto)",
+            data=json.dumps(to_chrome_trace(agentic_result["trace"], traditional_result["trace"])),
+            file_name="rag_trace.json",
+            mime="application/json"
+        )
         
         # Answer
         st.markdown("**Answer:**")
@@ -181,6 +374,7 @@ def main():
         # Routing Decision Details
         with st.expander("🧭 Detailed Routing Analysis", expanded=True):
             st.markdown(f"**Route Decision:** {agentic_result['route_decision']}")
+            st.markdown(f"**Router:** {'Fast-path (retrieval scores)' if agentic_result.get('router') == 'fast-path' else 'LLM'}")
             st.markdown(f"**Confidence Level:** {agentic_result.get('routing_confidence', 'Unknown').title()}")
             st.markdown(f"**Context Match Score:** {agentic_result.get('context_match_score', 0):.3f}")
             st.markdown(f"**Temporal Requirement:** {agentic_result.get('temporal_requirement', 'Unknown')}")
@@ -206,7 +400,10 @@ def main():
                             st.markdown(f"**Source:** {detail['source_file']}")
                             st.markdown(f"**Page:** {detail.get('page', 'N/A')}")
                         with col_b:
-                            st.metric("Similarity", f"{detail['similarity_score']:.3f}")
+                            if detail['similarity_score'] is not None:
+                                st.metric("Similarity", f"{detail['similarity_score']:.3f}")
+                            else:
+                                st.metric("Similarity", "keyword match")
                         with col_c:
                             st.metric("Length", f"{detail['content_length']} chars")
                         
@@ -228,7 +425,8 @@ def main():
                 st.markdown("**Search Information:**")
                 col_a, col_b, col_c = st.columns(3)
                 with col_a:
-                    st.metric("Search Time", f"{web_metadata.get('search_time', 0):.3f}s")
+                    st.metric("Search Time", f"{web_metadata.get('search_time', 0):.3f}s", 
+                              delta="cached" if web_metadata.get('cache_hit') else None, delta_color="off")
                 with col_b:
                     st.metric("Results Found", web_metadata.get('total_results', 'Unknown'))
                 with col_c:
@@ -256,12 +454,20 @@ def main():
                     st.markdown("---")
         
         # Metrics
-        col2a, col2b, col2c = st.columns(3)
+        col2a, col2b, col2c, col2d = st.columns(4)
         with col2a:
             st.metric("Time", f"{agentic_result['processing_time']:.2f}s")
         with col2b:
-            st.metric("Context", f"{agentic_result['context_length']} chars")
+            ttft = agentic_result.get('time_to_first_token')
+            st.metric("First Token", f"{ttft:.2f}s" if ttft is not None else "—")
         with col2c:
+            context_stats = agentic_result.get('context_stats')
+            if context_stats:
+                st.metric("Context", f"{context_stats['tokens_used']} tokens",
+                          delta=f"-{context_stats['tokens_saved']} saved", delta_color="off")
+            else:
+                st.metric("Context", f"{agentic_result['context_length']} chars")
+        with col2d:
             st.metric("Intelligence", agentic_result["intelligence_level"])
         
         # Pipeline visualization
@@ -269,6 +475,8 @@ def main():
         # st.plotly_chart(agentic_fig, use_container_width=True)
         
         st.markdown('</div>', unsafe_allow_html=True)
+
+    get_startup_report().record_once("first_render", render_started)
         
 
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+"""ONNX Runtime embedding backend for sentence-transformers models.
+
+Runs an exported (optionally int8-quantized) copy of the embedding model with length-sorted
+dynamic batching, so short chunks are not padded to the length of the longest one. Select it
+with EMBEDDING_BACKEND=onnx; the model is exported on first use.
+
+    python onnx_embeddings.py export              # export (and quantize) ahead of time
+    python onnx_embeddings.py parity              # compare against HuggingFaceEmbeddings
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", ".onnx_models")
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "1") == "1"
+# 0 lets ONNX Runtime use all physical cores
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))
+# Padded tokens per batch; batches of short chunks hold more texts than batches of long ones
+ONNX_BATCH_TOKENS = int(os.getenv("ONNX_BATCH_TOKENS", "8192"))
+ONNX_MAX_BATCH_SIZE = int(os.getenv("ONNX_MAX_BATCH_SIZE", "64"))
+# all-mpnet-base-v2 was trained on sequences of at most 384 tokens
+ONNX_MAX_LENGTH = int(os.getenv("ONNX_MAX_LENGTH", "384"))
+
+
+def _import_onnxruntime():
+    try:
+        import onnxruntime
+    except ImportError:
+        raise ImportError("EMBEDDING_BACKEND=onnx needs onnxruntime: pip install onnxruntime")
+    return onnxruntime
+
+
+def model_export_dir(model_name: str, model_dir: str = ONNX_MODEL_DIR) -> str:
+    return os.path.join(model_dir, re.sub(r"[^A-Za-z0-9_.-]+", "__", model_name))
+
+
+def export_model(model_name: str = EMBEDDING_MODEL, model_dir: str = ONNX_MODEL_DIR, quantize: bool = ONNX_QUANTIZE) -> str:
+    """Export the model and tokenizer to ONNX (once) and return the path of the model to run"""
+    export_dir = model_export_dir(model_name, model_dir)
+    model_path = os.path.join(export_dir, "model.onnx")
+    quantized_path = os.path.join(export_dir, "model_int8.onnx")
+
+    if not os.path.exists(model_path):
+        try:
+            from optimum.onnxruntime import ORTModelForFeatureExtraction
+        except ImportError:
+            raise ImportError("Exporting to ONNX needs optimum: pip install 'optimum[onnxruntime]'")
+        from transformers import AutoTokenizer
+        # Export to a temporary directory so a concurrent or interrupted export never leaves a partial model
+        tmp_dir = f"{export_dir}.tmp-{os.getpid()}"
+        ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(tmp_dir)
+        AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp_dir)
+        os.makedirs(model_dir, exist_ok=True)
+        if os.path.exists(export_dir):
+            import shutil
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        else:
+            os.replace(tmp_dir, export_dir)
+
+    if not quantize:
+        return model_path
+    if not os.path.exists(quantized_path):
+        _import_onnxruntime()
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        # Dynamic quantization: int8 weights, activations quantized on the fly - no calibration data needed
+        tmp_path = f"{quantized_path}.tmp-{os.getpid()}"
+        quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, quantized_path)
+    return quantized_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """LangChain embeddings running a sentence-transformers model with ONNX Runtime.
+
+    Mean-pools token embeddings and L2-normalizes them, matching HuggingFaceEmbeddings
+    with normalize_embeddings=True.
+    """
+
+    def __init__(
+            self,
+            model_name: str = EMBEDDING_MODEL,
+            model_dir: str = ONNX_MODEL_DIR,
+            quantize: bool = ONNX_QUANTIZE,
+            intra_op_threads: int = ONNX_INTRA_OP_THREADS,
+            batch_tokens: int = ONNX_BATCH_TOKENS,
+            max_batch_size: int = ONNX_MAX_BATCH_SIZE,
+            max_length: int = ONNX_MAX_LENGTH
+    ):
+        onnxruntime = _import_onnxruntime()
+        from transformers import AutoTokenizer
+
+        model_path = export_model(model_name, model_dir, quantize)
+        # Quantized outputs differ slightly, so they must not share cache entries with the float model
+        self.model_name = f"{model_name}:onnx" + ("-int8" if quantize else "")
+        self.batch_tokens = batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_export_dir(model_name, model_dir))
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = intra_op_threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self._lock = threading.Lock()
+
+    def _batches(self, lengths: list) -> list:
+        """Group text indices, shortest first, so each batch stays under the padded-token budget"""
+        order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+        batches, batch = [], []
+        for i in order:
+            # Sorted ascending, so the newest text is the longest in the batch
+            if batch and (len(batch) + 1) * lengths[i] > self.batch_tokens or len(batch) == self.max_batch_size:
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _run(self, encodings: list) -> np.ndarray:
+        # Pad only to the longest text in this batch
+        width = max(len(encoding) for encoding in encodings)
+        input_ids = np.full((len(encodings), width), self.tokenizer.pad_token_id or 0, dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, :len(encoding)] = encoding
+            attention_mask[row, :len(encoding)] = 1
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.zeros_like(inputs["input_ids"])
+        # ONNX Runtime parallelizes within a run; concurrent runs would only fight over the threads
+        with self._lock:
+            token_embeddings = self.session.run(None, inputs)[0]
+
+        mask = inputs["attention_mask"][:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def embed_documents(self, texts: list) -> list:
+        if not texts:
+            return []
+        encodings = self.tokenizer(
+            list(texts), truncation=True, max_length=self.max_length, add_special_tokens=True
+        )["input_ids"]
+        vectors = [None] * len(texts)
+        for batch in self._batches([len(encoding) for encoding in encodings]):
+            for i, vector in zip(batch, self._run([encodings[i] for i in batch])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        return self.embed_documents([text])[0]
+
+
+def check_parity(reference: Embeddings, candidate: Embeddings, texts: list, min_cosine: float = 0.99) -> dict:
+    """Compare two embedding backends on the same texts; cosine similarity per text"""
+    reference_vectors = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    candidate_vectors = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    cosines = (reference_vectors * candidate_vectors).sum(axis=1) / (
+        np.linalg.norm(reference_vectors, axis=1) * np.linalg.norm(candidate_vectors, axis=1)
+    )
+    # Ranking parity: does each text's nearest neighbour stay the same under both backends
+    reference_neighbours = _nearest_other(reference_vectors)
+    candidate_neighbours = _nearest_other(candidate_vectors)
+    return {
+        "texts": len(texts),
+        "min_cosine": round(float(cosines.min()), 5),
+        "mean_cosine": round(float(cosines.mean()), 5),
+        "max_abs_diff": round(float(np.abs(reference_vectors - candidate_vectors).max()), 5),
+        "nearest_neighbour_agreement": round(float((reference_neighbours == candidate_neighbours).mean()), 4),
+        "passed": bool(cosines.min() >= min_cosine)
+    }
+
+
+def _nearest_other(vectors: np.ndarray) -> np.ndarray:
+    similarities = vectors @ vectors.T
+    np.fill_diagonal(similarities, -np.inf)
+    return similarities.argmax(axis=1)
+
+
+def _sample_texts() -> list:
+    from knowledge_base import default_docs
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=300, chunk_overlap=0)
+    return [chunk.page_content for chunk in splitter.split_documents(default_docs)] + [
+        "What is Agentic RAG?", "latest AI news", "Who built this application?"
+    ]
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Export the embedding model to ONNX and check it")
+    parser.add_argument("command", choices=("export", "parity"))
+    parser.add_argument("--model", default=EMBEDDING_MODEL)
+    parser.add_argument("--no-quantize", dest="quantize", action="store_false", default=ONNX_QUANTIZE)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        print(export_model(args.model, quantize=args.quantize))
+        return 0
+
+    from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+    texts = _sample_texts()
+    reference = HuggingFaceEmbeddings(model_name=args.model, model_kwargs={'device': 'cpu'},
+                                      encode_kwargs={'normalize_embeddings': True})
+    candidate = OnnxEmbeddings(args.model, quantize=args.quantize)
+    for name, embeddings in (("huggingface", reference), ("onnx", candidate)):
+        start = time.perf_counter()
+        embeddings.embed_documents(texts)
+        print(f"{name:<12} {len(texts)} texts in {time.perf_counter() - start:.3f}s")
+    report = check_parity(reference, candidate, texts, args.min_cosine)
+    print(report)
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
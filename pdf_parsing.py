@@ -0,0 +1,54 @@
+"""PDF text extraction and chunking.
+
+Kept free of Streamlit, FAISS and model imports so process-pool workers start quickly.
+"""
+import io
+import time
+from pypdf import PdfReader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+# Chunking parameters are part of the stored knowledge-base key
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+
+def iter_pdf_pages(file_bytes, source):
+    """Yield one Document per PDF page, extracted straight from the in-memory upload"""
+    reader = PdfReader(io.BytesIO(file_bytes))
+    total_pages = len(reader.pages)
+    for page_number, page in enumerate(reader.pages):
+        yield Document(
+            page_content=page.extract_text() or "",
+            metadata={'source': source, 'page': page_number, 'total_pages': total_pages}
+        )
+
+
+def stream_pdf_chunks(file_bytes, source, progress_callback=None):
+    """Yield chunks page by page, so only one page's text is held before it is split"""
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+        separators=["\n\n", "\n", " ", ""],
+        # Offsets let the context builder merge neighbouring chunks exactly
+        add_start_index=True
+    )
+    for page in iter_pdf_pages(file_bytes, source):
+        page_chunks = text_splitter.split_documents([page])
+        if progress_callback:
+            progress_callback({
+                "file_name": source,
+                "stage": "page",
+                "page": page.metadata['page'] + 1,
+                "pages": page.metadata['total_pages'],
+                "chunks": len(page_chunks)
+            })
+        yield from page_chunks
+
+
+def parse_pdf(file_bytes, source):
+    """Extract and split a whole PDF; the unit of work for ingestion worker processes"""
+    parse_start_time = time.time()
+    chunks = list(stream_pdf_chunks(file_bytes, source))
+    return chunks, round(time.time() - parse_start_time, 3)
@@ -3,15 +3,169 @@ from retrieval import *
 from answer_generation import *
 from question_generation import *
 from utils import get_api_keys
+from answer_cache import get_answer_cache
+from kb_store import get_kb_version
+from context_builder import build_web_context, build_hybrid_context
+from tracing import Tracer, span, use_span, annotate
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time 
 
-def traditional_rag_query_enhanced(llm, vector_db, query: str) -> dict:
+# Shared pool for web searches started speculatively alongside the router call
+_speculative_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative-web")
+
+class SpeculativeSearchStats:
+    """Process-wide counters showing whether speculative web search pays off for a workload"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.launched = 0
+        self.used = 0
+        self.wasted = 0
+        self.cancelled = 0
+        self.time_saved = 0.0
+        self.time_wasted = 0.0
+    
+    def record(self, outcome: str, seconds: float = 0.0):
+        with self._lock:
+            if outcome == "launched":
+                self.launched += 1
+            elif outcome == "used":
+                self.used += 1
+                self.time_saved += seconds
+            elif outcome == "wasted":
+                self.wasted += 1
+            elif outcome == "wasted_time":
+                self.time_wasted += seconds
+            elif outcome == "cancelled":
+                self.cancelled += 1
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "launched": self.launched,
+                "used": self.used,
+                "wasted": self.wasted,
+                "cancelled": self.cancelled,
+                "time_saved": round(self.time_saved, 3),
+                "time_wasted": round(self.time_wasted, 3),
+                "use_rate": round(self.used / self.launched, 3) if self.launched else 0
+            }
+
+speculative_search_stats = SpeculativeSearchStats()
+
+def get_speculative_search_stats() -> dict:
+    """Get speculative web search counters for this process"""
+    return speculative_search_stats.snapshot()
+
+def _timed_web_search(query: str, parent_span=None) -> tuple:
+    search_start = time.time()
+    if parent_span is None:
+        web_result = get_web_content_enhanced(query)
+    else:
+        # Runs on a pool thread, so the request's span is made current here explicitly
+        with use_span(parent_span), span("speculative_web_search"):
+            web_result = get_web_content_enhanced(query)
+    return web_result, search_start, time.time()
+
+class AnswerGenerator:
+    """Generates answers for one request, streaming them to a callback if one is given"""
+    
+    def __init__(self, llm, stream_callback=None, start_time: float = None):
+        self.llm = llm
+        self.stream_callback = stream_callback
+        self.start_time = start_time or time.time()
+        self.time_to_first_token = None
+        # Whether the latest answer failed, even if part of it was streamed first
+        self.failed = False
+    
+    def generate(self, context: str, query: str, source_type: str, sources: list = None) -> str:
+        with span("answer_generation", source_type=source_type, context_chars=len(context),
+                  streamed=self.stream_callback is not None):
+            if self.stream_callback is None:
+                answer = generate_answer_enhanced(self.llm, context, query, source_type, sources)
+                # Unstreamed, a failed answer is the error message alone
+                self.failed = answer.startswith(ANSWER_ERROR_PREFIX)
+                return answer
+            
+            # The callback gets the answer so far, so a regenerated answer simply replaces the old one
+            answer = ""
+            self.failed = False
+            try:
+                for text in stream_answer_enhanced(self.llm, context, query, source_type, sources):
+                    if self.time_to_first_token is None:
+                        self.time_to_first_token = time.time() - self.start_time
+                        annotate(time_to_first_token=round(self.time_to_first_token, 3))
+                    answer += text
+                    self.stream_callback(answer)
+            except Exception as e:
+                # Keep what was already shown and say why it stopped
+                self.failed = True
+                annotate(stream_error=str(e))
+                answer += ("\n\n" if answer else "") + f"{ANSWER_ERROR_PREFIX}: {str(e)}"
+                self.stream_callback(answer)
+            return answer
+
+class SpeculativeWebSearch:
+    """Web search started before the routing decision; claimed if the route needs the web"""
+    
+    def __init__(self, query: str, enabled: bool, parent_span=None):
+        self.query = query
+        self.future = None
+        self.outcome = None
+        self.time_saved = 0.0
+        if enabled:
+            self.future = _speculative_executor.submit(_timed_web_search, query, parent_span)
+            speculative_search_stats.record("launched")
+    
+    def get(self) -> dict:
+        """Web result for the query - the speculative one if available, else a fresh search"""
+        if self.future is None or self.outcome is not None:
+            return get_web_content_enhanced(self.query)
+        
+        needed_at = time.time()
+        web_result, search_start, search_end = self.future.result()
+        # Without speculation the search would have started now and taken its full duration
+        self.time_saved = (search_end - search_start) - max(0.0, search_end - needed_at)
+        self.outcome = "used"
+        speculative_search_stats.record("used", self.time_saved)
+        annotate(speculative=True, time_saved=round(self.time_saved, 3))
+        return web_result
+    
+    def finish(self) -> dict:
+        """Cancel or discard an unclaimed search and describe what happened"""
+        if self.future is not None and self.outcome is None:
+            if self.future.cancel():
+                self.outcome = "cancelled"
+                speculative_search_stats.record("cancelled")
+            else:
+                self.outcome = "wasted"
+                speculative_search_stats.record("wasted")
+                self.future.add_done_callback(self._record_wasted_time)
+        return {
+            "enabled": self.future is not None,
+            "outcome": self.outcome,
+            "time_saved": round(self.time_saved, 3)
+        }
+    
+    @staticmethod
+    def _record_wasted_time(future):
+        if not future.cancelled() and future.exception() is None:
+            _, search_start, search_end = future.result()
+            speculative_search_stats.record("wasted_time", search_end - search_start)
+
+def traditional_rag_query_enhanced(llm, vector_db, query: str, retrieval_context: RetrievalContext = None) -> dict:
     """Enhanced traditional RAG with simpler, more basic behavior"""
     start_time = time.time()
+    tracer = Tracer("traditional_rag")
+    if retrieval_context is None:
+        retrieval_context = RetrievalContext(vector_db, query)
     
     # Traditional RAG: Simple, fixed approach
-    context = traditional_rag_simple_retrieval(vector_db, query, k=2)  # Fewer docs
-    answer = generate_answer_enhanced(llm, context, query, "local")
+    with tracer.span("local_retrieval", k=2):
+        context = retrieval_context.traditional_rag_simple_retrieval(k=2)  # Fewer docs
+    with tracer.span("answer_generation", source_type="local", context_chars=len(context), streamed=False):
+        answer = generate_answer_enhanced(llm, context, query, "local")
     
     processing_time = time.time() - start_time
     
@@ -27,82 +181,153 @@ def traditional_rag_query_enhanced(llm, vector_db, query: str) -> dict:
             "Basic similarity matching", 
             "Simple answer generation"
         ],
+        "trace": tracer.finish(),
         "intelligence_level": "Basic"
     }
 
-def agentic_rag_query_enhanced(llm, vector_db, query: str) -> dict:
-    """Enhanced Agentic RAG with sophisticated routing and detailed transparency"""
+def agentic_rag_query_enhanced(
+        llm, 
+        vector_db, 
+        query: str, 
+        retrieval_context: RetrievalContext = None, 
+        speculative_web: bool = False,
+        semantic_cache: bool = False,
+        fast_router: bool = True,
+        stream_callback=None
+) -> dict:
+    """Enhanced Agentic RAG with sophisticated routing and detailed transparency.
+    
+    If stream_callback is given, the answer is streamed to it as it is generated;
+    it is called with the full answer text so far.
+    """
     start_time = time.time()
+    tracer = Tracer("agentic_rag")
     processing_steps = []
+    answer_generator = AnswerGenerator(llm, stream_callback, start_time)
+    # One query embedding and one search serve every stage below
+    if retrieval_context is None:
+        retrieval_context = RetrievalContext(vector_db, query)
+    
+    # Paraphrases of an already answered question skip routing and generation entirely
+    if semantic_cache:
+        with tracer.span("semantic_cache_lookup") as cache_span:
+            kb_version = get_kb_version(vector_db)
+            cached = get_answer_cache().lookup(retrieval_context.query_embedding, kb_version)
+            cache_span.set(hit=cached is not None)
+            if cached is not None:
+                cache_span.set(similarity=round(cached[1], 3))
+        if cached is not None:
+            cached_result, similarity, matched_query = cached
+            cached_result["processing_time"] = time.time() - start_time
+            cached_result["processing_steps"] = [
+                "Embedding query for semantic cache lookup",
+                f"Reusing answer to a similar question (similarity {similarity:.3f})"
+            ]
+            cached_result["speculative_search"] = {"enabled": False, "outcome": None, "time_saved": 0.0}
+            cached_result["semantic_cache"] = {"hit": True, "similarity": round(similarity, 3), "matched_query": matched_query}
+            cached_result["time_to_first_token"] = cached_result["processing_time"]
+            cached_result["trace"] = tracer.finish()
+            if stream_callback is not None:
+                stream_callback(cached_result["answer"])
+            return cached_result
+    
+    # Optionally start the web search now so it overlaps with the router call
+    web_search = SpeculativeWebSearch(query, enabled=speculative_web, parent_span=tracer.root)
     
     # Step 1: Intelligent analysis
     processing_steps.append("Analyzing query intent and context")
-    local_sample = get_local_content(vector_db, "sample", k=2)
-    sample_context = local_sample["content"] if isinstance(local_sample, dict) else str(local_sample)
+    if speculative_web:
+        processing_steps.append("Speculatively searching web while routing")
     
     # Step 2: Advanced routing decision with detailed analysis
     processing_steps.append("Making intelligent routing decision with confidence scoring")
-    # Get actual relevant context for the query instead of just sample
-    query_context = get_local_content(vector_db, query, k=3)
-    actual_context = query_context["content"] if isinstance(query_context, dict) else str(query_context)
-    routing_result = check_local_knowledge_enhanced(llm, query, actual_context)
+    with tracer.span("routing") as routing_span:
+        # Get actual relevant context for the query
+        with tracer.span("local_retrieval", k=3):
+            query_context = retrieval_context.get_local_content(k=3)
+        actual_context = query_context["content"] if isinstance(query_context, dict) else str(query_context)
+        # Clear-cut cases are decided from retrieval scores; only the ambiguous middle costs an LLM call
+        routing_result = None
+        if fast_router:
+            with tracer.span("fast_route"):
+                routing_result = fast_route(query, query_context["source_details"])
+        if routing_result is None:
+            with tracer.span("llm_router", context_chars=len(actual_context)):
+                routing_result = check_local_knowledge_enhanced(llm, query, actual_context)
+        else:
+            processing_steps.append(f"Fast-path routing from retrieval scores (top cosine similarity {routing_result['top_similarity']:.3f})")
+        routing_span.set(router=routing_result["router"], route=routing_result["route"],
+                         confidence=routing_result["confidence"])
+    record_router_decision(routing_result["router"])
     route = routing_result["route"]
     
     # Step 3: Source-specific retrieval with detailed tracking
     sources = []
     local_source_details = []
     web_metadata = {}
-    context_parts = []
     
     if route == "LOCAL":
         processing_steps.append("Retrieving from curated knowledge base with similarity scoring")
-        local_result = get_local_content(vector_db, query, k=4)
+        with tracer.span("local_retrieval", k=4) as retrieval_span:
+            local_result = retrieval_context.get_local_content(k=4)
+            retrieval_span.set(**local_result["context_stats"])
         context = local_result["content"]
+        context_stats = local_result["context_stats"]
         source_type = "local"
         local_source_details = local_result["source_details"]
         
     elif route == "WEB":
         processing_steps.append("Searching web for current information with source tracking")
-        web_result = get_web_content_enhanced(query)
-        context = web_result["content"]
+        with tracer.span("web_search"):
+            web_result = web_search.get()
+        with tracer.span("context_assembly") as context_span:
+            context, context_stats = build_web_context(web_result["content"])
+            context_span.set(**context_stats)
         sources = web_result["sources"]
         web_metadata = web_result.get("search_metadata", {})
         source_type = "web"
         
     else:  # HYBRID routing
         processing_steps.append("Retrieving from local knowledge base")
-        local_result = get_local_content(vector_db, query, k=3)
-        local_context = local_result["content"]
+        with tracer.span("local_retrieval", k=3):
+            local_result = retrieval_context.get_local_content(k=3)
         local_source_details = local_result["source_details"]
-        context_parts.append(f"**Local Knowledge:**\n{local_context}")
         
         processing_steps.append("Searching web for additional current information")
-        web_result = get_web_content_enhanced(query)
-        web_context = web_result["content"]
+        with tracer.span("web_search"):
+            web_result = web_search.get()
         sources = web_result["sources"]
         web_metadata = web_result.get("search_metadata", {})
-        context_parts.append(f"**Current Web Information:**\n{web_context}")
         
-        # Combine both contexts
-        context = "\n\n".join(context_parts)
+        # Combine both contexts in one token budget, web snippets capped to a share of it
+        with tracer.span("context_assembly") as context_span:
+            context, context_stats = build_hybrid_context(
+                local_result["context_pieces"], local_result["context_stats"], web_result["content"]
+            )
+            context_span.set(**context_stats)
         source_type = "hybrid"
     
     # Step 4: Enhanced answer generation with quality check
+    processing_steps.append(f"Assembled {context_stats['tokens_used']} context tokens "
+                            f"({context_stats['tokens_saved']} saved by de-duplication and the token budget)")
     processing_steps.append("Generating contextually-aware response with source attribution")
-    answer = generate_answer_enhanced(llm, context, query, source_type, sources)
+    with tracer.activate():
+        answer = answer_generator.generate(context, query, source_type, sources)
     
     # Step 5: Quality check for LOCAL routing - fallback to WEB if answer is poor
     if route == "LOCAL" and routing_result.get("confidence", "medium").lower() != "high":
         # Check if the answer seems incomplete or generic
         if len(answer) < 100 or "I don't have" in answer or "not available" in answer.lower() or "cannot find" in answer.lower():
             processing_steps.append("Local answer insufficient - falling back to web search")
-            web_result = get_web_content_enhanced(query)
-            web_context = web_result["content"]
-            web_sources = web_result["sources"]
-            web_metadata = web_result.get("search_metadata", {})
-            
-            # Generate new answer with web content
-            fallback_answer = generate_answer_enhanced(llm, web_context, query, "web", web_sources)
+            with tracer.span("web_fallback"):
+                with tracer.span("web_search"):
+                    web_result = web_search.get()
+                web_context, context_stats = build_web_context(web_result["content"])
+                web_sources = web_result["sources"]
+                web_metadata = web_result.get("search_metadata", {})
+                
+                # Generate new answer with web content
+                fallback_answer = answer_generator.generate(web_context, query, "web", web_sources)
             
             # Update results to reflect the fallback
             answer = fallback_answer
@@ -113,23 +338,75 @@ def agentic_rag_query_enhanced(llm, vector_db, query: str) -> dict:
             route = "WEB (Fallback)"
             routing_result["reasoning"] += " [System detected insufficient local information and switched to web search]"
     
+    speculative_search = web_search.finish()
     processing_time = time.time() - start_time
     
-    return {
+    result = {
         "answer": answer,
         "source_type": source_type,
         "processing_time": processing_time,
+        "time_to_first_token": answer_generator.time_to_first_token,
         "context_length": len(context),
+        "context_stats": context_stats,
         "route_decision": route,
         "routing_explanation": routing_result["reasoning"],
         "routing_confidence": routing_result["confidence"],
         "context_match_score": routing_result.get("context_match_score", 0),
         "temporal_requirement": routing_result.get("temporal_requirement", "NO"),
         "full_routing_analysis": routing_result.get("full_analysis", ""),
+        "router": routing_result["router"],
         "processing_steps": processing_steps,
         "intelligence_level": "Advanced",
         "sources": sources,
         "local_source_details": local_source_details,
         "web_metadata": web_metadata,
-        "total_sources_used": len(local_source_details) if source_type == "local" else len(sources)
+        "total_sources_used": len(local_source_details) if source_type == "local" else len(sources),
+        "speculative_search": speculative_search,
+        "semantic_cache": {"hit": False},
+        "trace": tracer.finish()
+    }
+    
+    # Answers that depend on current information, that failed, or whose route is only the
+    # router-error default are not worth reusing
+    if (semantic_cache and result["temporal_requirement"] != "YES"
+            and not answer_generator.failed and not routing_result.get("router_error")):
+        get_answer_cache().store(query, retrieval_context.query_embedding, kb_version, result)
+    
+    return result
+
+
+def run_pipelines(
+        llm, 
+        vector_db, 
+        query: str, 
+        retrieval_context: RetrievalContext = None, 
+        concurrent: bool = True, 
+        **agentic_options
+) -> tuple:
+    """Run traditional and agentic RAG for one query, concurrently by default.
+    
+    Both pipelines are dominated by network-bound LLM and search calls, so running them
+    together makes the wall-clock time roughly that of the slower pipeline. The agentic
+    pipeline stays on the calling thread so a stream_callback can update the UI.
+    agentic_options are passed on to agentic_rag_query_enhanced.
+    """
+    start_time = time.time()
+    if retrieval_context is None:
+        retrieval_context = RetrievalContext(vector_db, query)
+    
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-pipeline") as executor:
+            traditional_future = executor.submit(traditional_rag_query_enhanced, llm, vector_db, query, retrieval_context)
+            agentic_result = agentic_rag_query_enhanced(llm, vector_db, query, retrieval_context, **agentic_options)
+            traditional_result = traditional_future.result()
+    else:
+        traditional_result = traditional_rag_query_enhanced(llm, vector_db, query, retrieval_context)
+        agentic_result = agentic_rag_query_enhanced(llm, vector_db, query, retrieval_context, **agentic_options)
+    
+    timings = {
+        "traditional": traditional_result["processing_time"],
+        "agentic": agentic_result["processing_time"],
+        "wall_clock": time.time() - start_time,
+        "concurrent": concurrent
     }
+    return traditional_result, agentic_result, timings
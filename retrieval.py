@@ -1,3 +1,105 @@
+import os
+import threading
+from tracing import span, annotate
+from lexical_index import LEXICAL_SEARCH, lexical_search
+from context_builder import build_local_context
+
+# Largest k any pipeline stage slices from the shared per-request search
+MAX_RETRIEVAL_K = 4
+# Hits taken from the vector and the keyword index before reciprocal-rank fusion
+FUSION_CANDIDATES = int(os.getenv("FUSION_CANDIDATES", "10"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+def embed_query(vector_db, query: str) -> list:
+    """Embed a query with the embedding model behind a vector database"""
+    embedding_function = vector_db.embedding_function
+    if hasattr(embedding_function, "embed_query"):
+        return embedding_function.embed_query(query)
+    return embedding_function(query)
+
+def index_size(vector_db) -> int:
+    """Number of searchable chunks in a FAISS vector database or a layered store"""
+    return vector_db.ntotal if hasattr(vector_db, "ntotal") else vector_db.index.ntotal
+
+def _doc_key(doc):
+    return doc.id or doc.page_content
+
+def fuse_rankings(dense_hits: list, lexical_hits: list, k: int) -> tuple:
+    """Reciprocal-rank fusion of vector and keyword hits, each chunk scored sum(1 / (RRF_K + rank)).
+    
+    Returns the k best as (document, distance) pairs - distance None for chunks only the
+    keyword index found - and how each was matched ("semantic", "keyword" or "both").
+    """
+    fused, hits, matches = {}, {}, {}
+    for rank, (doc, distance) in enumerate(dense_hits):
+        key = _doc_key(doc)
+        fused[key] = fused.get(key, 0.0) + 1 / (RRF_K + rank + 1)
+        hits[key] = (doc, distance)
+        matches[key] = "semantic"
+    for rank, (doc, _) in enumerate(lexical_hits):
+        key = _doc_key(doc)
+        fused[key] = fused.get(key, 0.0) + 1 / (RRF_K + rank + 1)
+        hits.setdefault(key, (doc, None))
+        matches[key] = "both" if key in matches else "keyword"
+    best = sorted(fused, key=fused.get, reverse=True)[:k]
+    return [hits[key] for key in best], {key: matches[key] for key in best}
+
+def hybrid_search(vector_db, query: str, query_embedding: list, k: int) -> tuple:
+    """(dense hits, fused hits, matches): vector search fused with BM25 keyword search"""
+    fetch_k = max(k, FUSION_CANDIDATES) if LEXICAL_SEARCH else k
+    with span("vector_search", k=fetch_k, index_size=index_size(vector_db)):
+        dense_hits = vector_db.similarity_search_with_score_by_vector(query_embedding, k=fetch_k)
+    if not LEXICAL_SEARCH:
+        return dense_hits, dense_hits, {_doc_key(doc): "semantic" for doc, _ in dense_hits}
+    with span("lexical_search", k=fetch_k):
+        lexical_hits = lexical_search(vector_db, query, fetch_k)
+        annotate(hits=len(lexical_hits))
+    fused_hits, matches = fuse_rankings(dense_hits, lexical_hits, k)
+    return dense_hits[:k], fused_hits, matches
+
+def _format_local_content(docs_with_scores, matches: dict = None) -> dict:
+    """Turn (document, distance) pairs into content with detailed source information.
+    
+    The content is assembled by the context builder: chunks scoring far below the best are
+    left out, overlapping chunks merged and the text cut to the token budget.
+    Chunks found by keyword search alone have no distance, so no similarity score.
+    """
+    context = build_local_context(docs_with_scores, matches, key=_doc_key)
+    source_details = []
+    similarities = []
+    
+    for i, (doc, score) in enumerate(context["selected"]):
+        similarity = round(1 - float(score), 3) if score is not None else None  # Convert distance to similarity
+        if similarity is not None:
+            similarities.append(1 - float(score))
+        source_details.append({
+            "chunk_id": i + 1,
+            "similarity_score": similarity,
+            "match": (matches or {}).get(_doc_key(doc), "semantic"),
+            "source_file": doc.metadata.get('source', 'Unknown'),
+            "page": doc.metadata.get('page', 'N/A'),
+            "content_preview": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
+            "content_length": len(doc.page_content)
+        })
+    
+    return {
+        "content": context["content"],
+        "source_details": source_details,
+        "total_chunks": len(context["selected"]),
+        "avg_similarity": round(sum(similarities) / len(similarities), 3) if similarities else 0,
+        "context_pieces": context["pieces"],
+        "context_stats": context["stats"]
+    }
+
+def _empty_local_content() -> dict:
+    return {
+        "content": "",
+        "source_details": [],
+        "total_chunks": 0,
+        "avg_similarity": 0,
+        "context_pieces": [],
+        "context_stats": build_local_context([])["stats"]
+    }
 
 def get_local_content(
         vector_db, 
@@ -7,36 +109,11 @@ def get_local_content(
     
     """Retrieve content from vector database with detailed information"""
     try:
-        docs_with_scores = vector_db.similarity_search_with_score(query, k=k)
-        
-        content_pieces = []
-        source_details = []
-        
-        for i, (doc, score) in enumerate(docs_with_scores):
-            content_pieces.append(doc.page_content)
-            source_details.append({
-                "chunk_id": i + 1,
-                "similarity_score": round(1 - score, 3),  # Convert distance to similarity
-                "source_file": doc.metadata.get('source', 'Unknown'),
-                "page": doc.metadata.get('page', 'N/A'),
-                "content_preview": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                "content_length": len(doc.page_content)
-            })
-        
-        return {
-            "content": ' '.join(content_pieces),
-            "source_details": source_details,
-            "total_chunks": len(docs_with_scores),
-            "avg_similarity": round(sum([1 - score for _, score in docs_with_scores]) / len(docs_with_scores), 3) if docs_with_scores else 0
-        }
+        _, docs_with_scores, matches = hybrid_search(vector_db, query, embed_query(vector_db, query), k)
+        return _format_local_content(docs_with_scores, matches)
     except Exception as e:
         print(f"Error in get_local_content: {e}")
-        return {
-            "content": "",
-            "source_details": [],
-            "total_chunks": 0,
-            "avg_similarity": 0
-        }
+        return _empty_local_content()
 
 def traditional_rag_simple_retrieval(
         vector_db, 
@@ -52,3 +129,56 @@ def traditional_rag_simple_retrieval(
         return content
     except:
         return ""
+
+class RetrievalContext:
+    """Per-request retrieval that embeds the query once and searches once at the largest k.
+    
+    Pipeline stages take slices of the shared result instead of searching again: the
+    fused vector and keyword ranking, or the plain vector ranking for traditional RAG.
+    Safe to share between pipelines running in different threads.
+    """
+    
+    def __init__(self, vector_db, query: str, max_k: int = MAX_RETRIEVAL_K):
+        self.vector_db = vector_db
+        self.query = query
+        self.max_k = max_k
+        self._query_embedding = None
+        self._dense_hits = None
+        self._docs_with_scores = None
+        self._matches = None
+        self._lock = threading.Lock()
+    
+    @property
+    def query_embedding(self) -> list:
+        """Query vector, computed on first use"""
+        with self._lock:
+            if self._query_embedding is None:
+                with span("embed_query", query_chars=len(self.query)):
+                    self._query_embedding = embed_query(self.vector_db, self.query)
+            return self._query_embedding
+    
+    def _search(self, k: int, dense_only: bool = False) -> list:
+        if k > self.max_k:
+            raise ValueError(f"Requested k={k} exceeds the retrieval context max_k={self.max_k}")
+        query_embedding = self.query_embedding
+        with self._lock:
+            if self._docs_with_scores is None:
+                self._dense_hits, self._docs_with_scores, self._matches = hybrid_search(
+                    self.vector_db, self.query, query_embedding, self.max_k
+                )
+            return (self._dense_hits if dense_only else self._docs_with_scores)[:k]
+    
+    def get_local_content(self, k: int = 3) -> dict:
+        """Same as get_local_content, served from the shared search"""
+        try:
+            return _format_local_content(self._search(k), self._matches)
+        except Exception as e:
+            print(f"Error in get_local_content: {e}")
+            return _empty_local_content()
+    
+    def traditional_rag_simple_retrieval(self, k: int = 2) -> str:
+        """Same as traditional_rag_simple_retrieval, served from the shared search"""
+        try:
+            return " ".join([doc.page_content[:300] for doc, _ in self._search(k, dense_only=True)])
+        except:
+            return ""
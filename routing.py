@@ -1,8 +1,91 @@
+import os
+import re
 import time
-import requests
-import json
+import threading
 from typing import Optional
-from utils import get_api_keys
+from search_client import get_search_client, SearchError
+from web_cache import get_web_cache
+from tracing import span, annotate, annotate_token_usage
+
+# Number of results requested per search; part of the web cache key
+WEB_SEARCH_NUM_RESULTS = 5
+
+# Cosine similarity bands of the top retrieved chunk for the fast-path router
+FAST_ROUTE_LOCAL_THRESHOLD = float(os.getenv("FAST_ROUTE_LOCAL_THRESHOLD", "0.78"))
+FAST_ROUTE_WEB_THRESHOLD = float(os.getenv("FAST_ROUTE_WEB_THRESHOLD", "0.2"))
+# LOCAL routes this far above the threshold are "high" confidence and skip the answer-quality fallback
+FAST_ROUTE_HIGH_CONFIDENCE_MARGIN = float(os.getenv("FAST_ROUTE_HIGH_CONFIDENCE_MARGIN", "0.1"))
+
+TEMPORAL_PATTERN = re.compile(
+    r"\b(latest|current(ly)?|today|tonight|tomorrow|yesterday|now|recent(ly)?|news|upcoming|"
+    r"this (week|month|year)|live|price|stock|weather|score|election|20[2-9]\d)\b",
+    re.IGNORECASE
+)
+
+def detect_temporal_need(query: str) -> bool:
+    """Cheap keyword check for queries that need current information"""
+    return bool(TEMPORAL_PATTERN.search(query))
+
+def cosine_similarity(similarity_score: float) -> float:
+    """Cosine of a retrieval similarity score.
+    
+    FAISS returns squared L2 distance d, and similarity_score is 1 - d; for normalized
+    embeddings d = 2 - 2 cos, so cos = 1 - d / 2.
+    """
+    return 1 - (1 - similarity_score) / 2
+
+def fast_route(query: str, source_details: list):
+    """Decide LOCAL or WEB from retrieval scores alone when the case is clear-cut.
+    
+    Returns a routing result like check_local_knowledge_enhanced, or None if the
+    query falls in the ambiguous band and needs the LLM router.
+    """
+    scores = [cosine_similarity(detail["similarity_score"]) for detail in source_details if detail.get("similarity_score") is not None]
+    top_similarity = max(scores, default=0.0)
+    temporal_need = detect_temporal_need(query)
+    # A top chunk the keyword index matched (e.g. an exact name or ID) is evidence the similarity misses
+    keyword_top_hit = bool(source_details) and source_details[0].get("match") in ("keyword", "both")
+    
+    if top_similarity >= FAST_ROUTE_LOCAL_THRESHOLD and not temporal_need:
+        route = "LOCAL"
+        reasoning = f"Local documents match the query closely (top cosine similarity {top_similarity:.3f}) and no current information is needed"
+        # Near the threshold, keep the local answer-quality check (and its web fallback) on
+        confidence = "high" if top_similarity >= FAST_ROUTE_LOCAL_THRESHOLD + FAST_ROUTE_HIGH_CONFIDENCE_MARGIN else "medium"
+    elif top_similarity <= FAST_ROUTE_WEB_THRESHOLD and not keyword_top_hit:
+        route = "WEB"
+        reasoning = f"Local documents barely match the query (top cosine similarity {top_similarity:.3f})"
+        confidence = "high"
+    else:
+        return None
+    
+    return {
+        "route": route,
+        "reasoning": reasoning,
+        "confidence": confidence,
+        "context_match_score": round(min(max(top_similarity, 0.0), 1.0), 3),
+        "temporal_requirement": "YES" if temporal_need else "NO",
+        "full_analysis": f"Fast-path router: top cosine similarity {top_similarity:.3f} "
+                         f"(LOCAL >= {FAST_ROUTE_LOCAL_THRESHOLD}, WEB <= {FAST_ROUTE_WEB_THRESHOLD}), "
+                         f"temporal keywords: {'YES' if temporal_need else 'NO'}",
+        "router": "fast-path",
+        "top_similarity": top_similarity
+    }
+
+_router_stats = {"fast-path": 0, "llm": 0}
+_router_stats_lock = threading.Lock()
+
+def record_router_decision(router: str):
+    with _router_stats_lock:
+        _router_stats[router] = _router_stats.get(router, 0) + 1
+
+def get_router_stats() -> dict:
+    """Count of routing decisions by router, showing how many LLM router calls were saved"""
+    with _router_stats_lock:
+        total = sum(_router_stats.values())
+        return {
+            **_router_stats,
+            "llm_calls_saved_rate": round(_router_stats["fast-path"] / total, 3) if total else 0
+        }
 
 def check_local_knowledge_enhanced(llm, query: str, context: str) -> dict:
     """Enhanced router with detailed reasoning and confidence scoring"""
@@ -69,6 +152,7 @@ def check_local_knowledge_enhanced(llm, query: str, context: str) -> dict:
     
     try:
         response = llm.invoke(router_prompt)
+        annotate_token_usage(response)
         decision_text = response.content.strip()
         
         # Parse the structured response
@@ -106,7 +190,8 @@ def check_local_knowledge_enhanced(llm, query: str, context: str) -> dict:
             "confidence": confidence.lower(),
             "context_match_score": context_match,
             "temporal_requirement": temporal_need,
-            "full_analysis": decision_text
+            "full_analysis": decision_text,
+            "router": "llm"
         }
     except Exception as e:
         return {
@@ -115,104 +200,135 @@ def check_local_knowledge_enhanced(llm, query: str, context: str) -> dict:
             "confidence": "low",
             "context_match_score": 0.0,
             "temporal_requirement": "UNKNOWN",
-            "full_analysis": "Error in routing analysis"
+            "full_analysis": "Error in routing analysis",
+            "router": "llm",
+            "router_error": True
         }
     
 
-def get_web_content_enhanced(query: str) -> dict:
-    """Enhanced web content retrieval with detailed source information"""
-    # Get API keys from session state
-    groq_key, serper_key, gemini_key = get_api_keys()
+def _web_search_unavailable(query: str) -> dict:
+    return {
+        "content": "Web search unavailable - Serper API key not configured",
+        "sources": [],
+        "search_metadata": {
+            "search_query": query,
+            "error": "No API key configured",
+            "status": "Failed"
+        },
+        "success": False,
+        "result_count": 0
+    }
+
+def _web_search_failed(query: str, content: str, error: str, search_time: float) -> dict:
+    return {
+        "content": content,
+        "sources": [],
+        "search_metadata": {
+            "search_query": query,
+            "search_time": round(search_time, 3),
+            "error": error
+        },
+        "success": False,
+        "result_count": 0,
+        "search_query_used": query
+    }
+
+def _format_web_results(query: str, results: dict, search_time: float) -> dict:
+    """Turn raw Serper results into content with detailed source information"""
+    # Extract search metadata
+    search_metadata = {
+        "search_query": query,
+        "search_time": round(search_time, 3),
+        "total_results": results.get('searchInformation', {}).get('totalResults', 'Unknown'),
+        "search_time_google": results.get('searchInformation', {}).get('searchTime', 'Unknown')
+    }
     
-    if not serper_key:
-        return {
-            "content": "Web search unavailable - Serper API key not configured",
-            "sources": [],
-            "search_metadata": {
-                "search_query": query,
-                "error": "No API key configured",
-                "status": "Failed"
-            },
-            "success": False,
-            "result_count": 0
-        }
+    if 'organic' not in results:
+        return _web_search_failed(query, f"Limited web search results for: {query}", "No organic results", search_time)
+    
+    content_pieces = []
+    sources = []
     
-    url = 'https://google.serper.dev/search'
-    payload = {'q': query, 'num': 5}
-    headers = {
-        'X-API-KEY': serper_key,
-        'Content-Type': 'application/json'
+    for i, result in enumerate(results['organic'][:4]):
+        title = result.get('title', 'Untitled')
+        snippet = result.get('snippet', 'No description available')
+        link = result.get('link', '')
+        position = result.get('position', i+1)
+        
+        content_pieces.append(f"**Source {i+1}**: {title}\n{snippet}")
+        sources.append({
+            "position": position,
+            "title": title, 
+            "link": link,
+            "snippet": snippet,
+            "domain": link.split('/')[2] if '//' in link else 'Unknown domain',
+            "snippet_length": len(snippet)
+        })
+    
+    return {
+        "content": '\n\n'.join(content_pieces),
+        "sources": sources,
+        "search_metadata": search_metadata,
+        "success": True,
+        "result_count": len(sources),
+        "search_query_used": query
     }
+
+def _web_search_error(query: str, error: Exception, search_time: float) -> dict:
+    if isinstance(error, SearchError) and error.status_code is not None:
+        return _web_search_failed(query, f"Limited web search results for: {query}", str(error), search_time)
+    return _web_search_failed(query, f"Web search error for query: {query}", str(error), search_time)
+
+def _get_cached_web_content(query: str, lookup_start_time: float):
+    web_result = get_web_cache().get(query, num=WEB_SEARCH_NUM_RESULTS)
+    annotate(web_cache_hit=web_result is not None)
+    if web_result is not None:
+        web_result["search_metadata"]["original_search_time"] = web_result["search_metadata"].get("search_time", 0)
+        web_result["search_metadata"]["search_time"] = round(time.time() - lookup_start_time, 3)
+        web_result["search_metadata"]["cache_hit"] = True
+    return web_result
+
+def _cache_web_content(query: str, web_result: dict) -> dict:
+    # Failures are not cached so the next request retries the search
+    if web_result["success"]:
+        web_result["search_metadata"]["cache_hit"] = False
+        get_web_cache().set(query, web_result, num=WEB_SEARCH_NUM_RESULTS)
+    return web_result
+
+def get_web_content_enhanced(query: str) -> dict:
+    """Enhanced web content retrieval with detailed source information"""
+    search_start_time = time.time()
+    cached_result = _get_cached_web_content(query, search_start_time)
+    if cached_result is not None:
+        return cached_result
     
+    # Long-lived client: configuration loaded once, pooled keep-alive connections
+    client = get_search_client()
+    if not client.configured:
+        return _web_search_unavailable(query)
+    
+    try:
+        with span("serper_request", num=WEB_SEARCH_NUM_RESULTS):
+            results = client.search(query, num=WEB_SEARCH_NUM_RESULTS)
+        web_result = _format_web_results(query, results, time.time() - search_start_time)
+    except Exception as e:
+        return _web_search_error(query, e, time.time() - search_start_time)
+    return _cache_web_content(query, web_result)
+
+async def get_web_content_enhanced_async(query: str) -> dict:
+    """Async version of get_web_content_enhanced"""
     search_start_time = time.time()
+    cached_result = _get_cached_web_content(query, search_start_time)
+    if cached_result is not None:
+        return cached_result
+    
+    client = get_search_client()
+    if not client.configured:
+        return _web_search_unavailable(query)
     
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload), timeout=15)
-        search_time = time.time() - search_start_time
-        
-        if response.status_code == 200:
-            results = response.json()
-            
-            # Extract search metadata
-            search_metadata = {
-                "search_query": query,
-                "search_time": round(search_time, 3),
-                "total_results": results.get('searchInformation', {}).get('totalResults', 'Unknown'),
-                "search_time_google": results.get('searchInformation', {}).get('searchTime', 'Unknown')
-            }
-            
-            if 'organic' in results:
-                content_pieces = []
-                sources = []
-                
-                for i, result in enumerate(results['organic'][:4]):
-                    title = result.get('title', 'Untitled')
-                    snippet = result.get('snippet', 'No description available')
-                    link = result.get('link', '')
-                    position = result.get('position', i+1)
-                    
-                    content_pieces.append(f"**Source {i+1}**: {title}\n{snippet}")
-                    sources.append({
-                        "position": position,
-                        "title": title, 
-                        "link": link,
-                        "snippet": snippet,
-                        "domain": link.split('/')[2] if '//' in link else 'Unknown domain',
-                        "snippet_length": len(snippet)
-                    })
-                
-                return {
-                    "content": '\n\n'.join(content_pieces),
-                    "sources": sources,
-                    "search_metadata": search_metadata,
-                    "success": True,
-                    "result_count": len(sources),
-                    "search_query_used": query
-                }
-        
-        return {
-            "content": f"Limited web search results for: {query}",
-            "sources": [],
-            "search_metadata": {
-                "search_query": query,
-                "search_time": round(search_time, 3),
-                "error": f"HTTP {response.status_code}"
-            },
-            "success": False,
-            "result_count": 0,
-            "search_query_used": query
-        }
-        
+        results = await client.asearch(query, num=WEB_SEARCH_NUM_RESULTS)
+        web_result = _format_web_results(query, results, time.time() - search_start_time)
     except Exception as e:
-        return {
-            "content": f"Web search error for query: {query}",
-            "sources": [],
-            "search_metadata": {
-                "search_query": query,
-                "search_time": round(time.time() - search_start_time, 3),
-                "error": str(e)
-            },
-            "success": False,
-            "result_count": 0,
-            "search_query_used": query
-        }
+        return _web_search_error(query, e, time.time() - search_start_time)
+    return _cache_web_content(query, web_result)
@@ -0,0 +1,171 @@
+import os
+import time
+import json
+import random
+import asyncio
+import weakref
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from utils import get_api_keys
+
+SERPER_URL = os.getenv("SERPER_URL", "https://google.serper.dev/search")
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "15"))
+SEARCH_MAX_CONCURRENCY = int(os.getenv("SEARCH_MAX_CONCURRENCY", "8"))
+SEARCH_MAX_RETRIES = int(os.getenv("SEARCH_MAX_RETRIES", "3"))
+# Longest wait between retries, including waits asked for by a Retry-After header
+SEARCH_MAX_BACKOFF = float(os.getenv("SEARCH_MAX_BACKOFF", "10"))
+
+# Rate limiting and transient server errors are worth retrying; other failures are not
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class SearchError(Exception):
+    """Web search failed after retries"""
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SerperClient:
+    """Long-lived Serper client with pooled keep-alive connections, retries and bounded concurrency"""
+
+    def __init__(
+            self,
+            api_key: str,
+            url: str = SERPER_URL,
+            timeout: float = SEARCH_TIMEOUT,
+            max_concurrency: int = SEARCH_MAX_CONCURRENCY,
+            max_retries: int = SEARCH_MAX_RETRIES,
+            backoff: float = 0.5,
+            max_backoff: float = SEARCH_MAX_BACKOFF
+    ):
+        self.api_key = api_key
+        self.url = url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.headers = {
+            'X-API-KEY': api_key,
+            'Content-Type': 'application/json'
+        }
+
+        # Sync interface: one session, connection pool sized to the concurrency limit
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(self.headers)
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+
+        # Async interface: httpx clients are bound to an event loop, so one is kept per loop
+        # and dropped with it
+        self._async_clients = weakref.WeakKeyDictionary()  # loop -> (client, semaphore)
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def _retry_delay(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0.0), self.max_backoff)
+            except ValueError:
+                pass
+        # Exponential backoff with jitter so concurrent callers do not retry in lockstep
+        return min(self.backoff * (2 ** attempt) * (0.5 + random.random()), self.max_backoff)
+
+    def search(self, query: str, num: int = 5) -> dict:
+        """Run a search and return the raw Serper JSON"""
+        payload = json.dumps({'q': query, 'num': num})
+        # The concurrency slot is held per request, not across the waits between retries
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self._semaphore:
+                    response = self.session.post(self.url, data=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise SearchError(str(e))
+                time.sleep(self._retry_delay(attempt))
+                continue
+
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                raise SearchError(f"HTTP {response.status_code}", response.status_code)
+            time.sleep(self._retry_delay(attempt, response.headers.get("Retry-After")))
+
+    def _get_async_client(self) -> tuple:
+        loop = asyncio.get_running_loop()
+        entry = self._async_clients.get(loop)
+        if entry is None:
+            client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+            entry = self._async_clients[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+        return entry
+
+    async def asearch(self, query: str, num: int = 5) -> dict:
+        """Async version of search"""
+        client, semaphore = self._get_async_client()
+        payload = json.dumps({'q': query, 'num': num})
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with semaphore:
+                    response = await client.post(self.url, content=payload)
+            except httpx.HTTPError as e:
+                if attempt == self.max_retries:
+                    raise SearchError(str(e))
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+
+            if response.status_code == 200:
+                return response.json()
+            if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                raise SearchError(f"HTTP {response.status_code}", response.status_code)
+            await asyncio.sleep(self._retry_delay(attempt, response.headers.get("Retry-After")))
+
+    def close(self):
+        self.session.close()
+
+    async def aclose(self):
+        """Close the async client of the running event loop"""
+        entry = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].aclose()
+
+
+_search_client = None
+_search_client_lock = threading.Lock()
+
+
+def get_search_client() -> SerperClient:
+    """Get the process-wide search client, loading its configuration once it has an API key"""
+    global _search_client
+    with _search_client_lock:
+        if _search_client is not None and _search_client.configured:
+            return _search_client
+        # Without a key, check again on each call so a key set later is picked up,
+        # but keep the client (and its connection pool) until the key changes
+        groq_key, serper_key, gemini_key = get_api_keys()
+        if _search_client is None or _search_client.api_key != serper_key:
+            if _search_client is not None:
+                _search_client.close()
+            _search_client = SerperClient(serper_key)
+        return _search_client
+
+
+def set_search_client(client: SerperClient):
+    """Replace the process-wide search client, e.g. to point at a local stand-in server"""
+    global _search_client
+    with _search_client_lock:
+        _search_client = client
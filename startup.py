@@ -0,0 +1,219 @@
+"""Cold-start profiling and background warm-up.
+
+The embedding model, LLM client and default knowledge base are built on a background thread
+as soon as the app starts, so the UI renders while they load; the first question waits only
+for whatever is still loading. Every phase is recorded in a process-wide startup report.
+
+    python startup.py                    # import-time profile of main.py + warm-up report
+    python startup.py --module api --top 20
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+import subprocess
+from contextlib import contextmanager
+import streamlit as st
+
+# Build the models on a background thread at app start (0 = build them when first needed)
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") == "1"
+
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+class StartupReport:
+    """Timed startup phases, relative to the first import of this module (process start, in practice)"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self._lock = threading.Lock()
+
+    def record(self, name: str, start: float, end: float = None, **details):
+        """Record a phase that ran from `start` to `end` (perf_counter values)"""
+        end = time.perf_counter() if end is None else end
+        with self._lock:
+            self.phases.append({
+                "name": name,
+                "start": round(start - self.started, 4),
+                "duration": round(end - start, 4),
+                "thread": threading.current_thread().name,
+                **details
+            })
+
+    def record_once(self, name: str, start: float, end: float = None, **details):
+        """Record a phase only the first time, e.g. work repeated by every Streamlit rerun"""
+        if not self.has(name):
+            self.record(name, start, end, **details)
+
+    def has(self, name: str) -> bool:
+        with self._lock:
+            return any(phase["name"] == name for phase in self.phases)
+
+    @contextmanager
+    def phase(self, name: str, **details):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, **details)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase["start"])
+        return {
+            "phases": phases,
+            "elapsed": round(max((phase["start"] + phase["duration"] for phase in phases), default=0.0), 4)
+        }
+
+
+_report = StartupReport()
+
+
+def get_startup_report() -> StartupReport:
+    return _report
+
+
+class Warmup:
+    """Builds the base components and default knowledge base on a background thread"""
+
+    def __init__(self, report: StartupReport = None):
+        self.report = report or _report
+        self.llm = None
+        self.embeddings = None
+        self.vector_db = None
+        self.error = None
+        self.ready_after = None
+        self._components_ready = threading.Event()
+        self._done = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="startup-warmup", daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        # Imported here so the app's own imports stay light; torch and friends load on this thread
+        from utils import build_base_components
+        from knowledge_base import create_default_knowledge_base
+        try:
+            with self.report.phase("models"):
+                self.llm, self.embeddings = build_base_components()
+            # The first inference is much slower than the rest (lazy allocations, kernel selection);
+            # run it on the underlying model so it is neither served from nor written to the cache
+            with self.report.phase("embedding_warmup"):
+                getattr(self.embeddings, "underlying", self.embeddings).embed_query("warm-up query")
+            self._components_ready.set()
+            with self.report.phase("default_knowledge_base"):
+                self.vector_db = create_default_knowledge_base(self.embeddings)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.ready_after = time.perf_counter() - self.report.started
+            self._components_ready.set()
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set()
+
+    def components(self, timeout: float = None):
+        """(llm, embeddings), waiting for the warm-up if needed; re-raises its error"""
+        self._wait(self._components_ready, timeout)
+        if self.embeddings is None:
+            raise self.error
+        return self.llm, self.embeddings
+
+    def default_knowledge_base(self, timeout: float = None):
+        self._wait(self._done, timeout)
+        if self.error is not None:
+            raise self.error
+        return self.vector_db
+
+    def _wait(self, event: threading.Event, timeout: float):
+        if self._thread is None:
+            # Warm-up disabled: build in the first caller's thread instead
+            with self._run_lock:
+                if not self._done.is_set():
+                    self.run()
+        if not event.wait(timeout):
+            raise TimeoutError("Startup warm-up is still running")
+
+
+@st.cache_resource
+def start_warmup() -> Warmup:
+    """The process-wide warm-up, started on first call"""
+    warmup = Warmup()
+    return warmup.start() if STARTUP_WARMUP else warmup
+
+
+def profile_imports(module: str = "main", top: int = 15) -> dict:
+    """Import-time profile of a module, measured with `python -X importtime` in a fresh interpreter"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    direct, imports, packages, total_us = [], [], {}, 0
+    for line in result.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, depth, name = int(match[1]), int(match[2]), len(match[3]) // 2, match[4]
+        # Time spent in a module's own body, attributed to its top-level package
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + self_us
+        # Modules are listed after everything they import, so the target's direct imports come just before it
+        if depth == 1:
+            direct.append({"module": name, "cumulative_ms": round(cumulative_us / 1000, 1)})
+        elif depth == 0:
+            if name == module:
+                imports, total_us = direct, cumulative_us
+            direct = []
+    return {
+        "module": module,
+        "ok": result.returncode == 0,
+        "total_ms": round(total_us / 1000, 1),
+        "imports": sorted(imports, key=lambda entry: -entry["cumulative_ms"])[:top],
+        "packages": [
+            {"package": package, "self_ms": round(self_us / 1000, 1)}
+            for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]
+        ]
+    }
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Report where startup time goes before the first question can be answered")
+    parser.add_argument("--module", default="main", help="Module whose imports are profiled")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false", help="Only profile imports")
+    args = parser.parse_args(argv)
+
+    profile = profile_imports(args.module, args.top)
+    print(f"Importing {args.module}: {profile['total_ms']:.0f} ms" + ("" if profile["ok"] else " (import failed)"))
+    print("  Slowest imports (cumulative):")
+    for entry in profile["imports"]:
+        print(f"    {entry['cumulative_ms']:>9.1f} ms  {entry['module']}")
+    print("  Slowest packages (own module bodies):")
+    for entry in profile["packages"]:
+        print(f"    {entry['self_ms']:>9.1f} ms  {entry['package']}")
+    if not args.warmup:
+        return 0
+
+    warmup = Warmup()
+    warmup.run()
+    print("Warm-up:")
+    for phase in warmup.report.to_dict()["phases"]:
+        print(f"    {phase['duration'] * 1000:>9.1f} ms  {phase['name']}")
+    if warmup.error is not None:
+        print(f"Warm-up failed: {warmup.error}")
+        return 1
+    print(f"Ready to answer after {warmup.ready_after:.2f}s (plus {profile['total_ms'] / 1000:.2f}s of imports)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
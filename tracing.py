@@ -0,0 +1,160 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Stack of open spans per thread; instrumented code nests under the innermost one
+_local = threading.local()
+
+
+def _span_stack() -> list:
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+class Span:
+    """One timed stage of a request, with attributes and nested child spans"""
+
+    def __init__(self, name: str, tracer, parent=None, attributes: dict = None):
+        self.name = name
+        self.tracer = tracer
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.thread = threading.current_thread().name
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "start": round(self.start - self.tracer.root.start, 6),
+            "duration": round(self.duration, 6),
+            "thread": self.thread,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in list(self.children)]
+        }
+
+
+class Tracer:
+    """Collects the span tree for one pipeline run.
+
+    Use `with tracer.span(name, **attributes)` around stages; code further down the
+    call stack can open child spans with the module-level `span()` and `annotate()`.
+    """
+
+    def __init__(self, name: str, **attributes):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.root = Span(name, self, attributes=attributes)
+
+    @contextmanager
+    def span(self, name: str, parent: Span = None, **attributes):
+        stack = _span_stack()
+        if parent is None:
+            parent = stack[-1] if stack and stack[-1].tracer is self else self.root
+        new_span = Span(name, self, parent, attributes)
+        with self._lock:
+            parent.children.append(new_span)
+        stack.append(new_span)
+        try:
+            yield new_span
+        finally:
+            new_span.end = time.perf_counter()
+            stack.pop()
+
+    @contextmanager
+    def activate(self):
+        """Make the root span current on this thread, so instrumented calls nest under it"""
+        with use_span(self.root):
+            yield self.root
+
+    def finish(self) -> dict:
+        """Close the root span and return the trace as a dict"""
+        self.root.end = time.perf_counter()
+        trace = self.root.to_dict()
+        trace["started_at"] = self.started_at
+        return trace
+
+
+@contextmanager
+def use_span(current: Span):
+    """Make a span current on this thread, e.g. in a worker started on the span's behalf"""
+    stack = _span_stack()
+    stack.append(current)
+    try:
+        yield current
+    finally:
+        stack.pop()
+
+
+def current_span():
+    stack = _span_stack()
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Child span of the current span on this thread; does nothing when nothing is being traced"""
+    parent = current_span()
+    if parent is None:
+        yield None
+        return
+    with parent.tracer.span(name, parent=parent, **attributes) as new_span:
+        yield new_span
+
+
+def annotate(**attributes):
+    """Add attributes to the current span, if any"""
+    current = current_span()
+    if current is not None:
+        current.set(**attributes)
+
+
+def annotate_token_usage(message):
+    """Record LLM token counts from a LangChain message's usage metadata, if reported"""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        annotate(
+            input_tokens=usage.get("input_tokens"),
+            output_tokens=usage.get("output_tokens")
+        )
+
+
+def iter_spans(trace: dict, depth: int = 0):
+    """(depth, span dict) pairs in start order, depth first"""
+    yield depth, trace
+    for child in sorted(trace["children"], key=lambda child: child["start"]):
+        yield from iter_spans(child, depth + 1)
+
+
+def to_chrome_trace(*traces: dict) -> dict:
+    """Trace Event Format JSON for chrome://tracing or Perfetto, one process row per trace"""
+    events = []
+    origin = min(trace["started_at"] for trace in traces)
+    for pid, trace in enumerate(traces, 1):
+        offset = (trace["started_at"] - origin) * 1e6
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": trace["name"]}})
+        thread_ids = {}
+        for _, span_dict in iter_spans(trace):
+            tid = thread_ids.setdefault(span_dict["thread"], len(thread_ids) + 1)
+            events.append({
+                "name": span_dict["name"],
+                "cat": trace["name"],
+                "ph": "X",
+                "ts": round(offset + span_dict["start"] * 1e6, 1),
+                "dur": round(span_dict["duration"] * 1e6, 1),
+                "pid": pid,
+                "tid": tid,
+                "args": span_dict["attributes"]
+            })
+        for thread, tid in thread_ids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
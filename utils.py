@@ -2,10 +2,11 @@ import os
 import streamlit as st
 from dotenv import load_dotenv
 from langchain_community.vectorstores import FAISS
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
-from langchain_groq import ChatGroq
-from langchain.schema import Document
-from transformers import AutoModel, AutoTokenizer
+from embedding_cache import CachedEmbeddings
+from startup import start_warmup
+
+# huggingface (sentence-transformers on torch) or onnx (see onnx_embeddings.py)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "huggingface")
 
 
 
@@ -36,9 +37,50 @@ def get_api_keys():
 
 
 
-@st.cache_resource
+def build_base_components():
+    """Build the LLM and embeddings outside Streamlit (API service, batch jobs)"""
+    # Get API keys from session state or environment
+    groq_key, serper_key, gemini_key = get_api_keys()
+    
+    if not groq_key:
+        raise ValueError("Groq API key required for LLM functionality")
+    
+    # Imported here, like the embedding model, so importing utils stays cheap
+    from langchain_groq import ChatGroq
+    
+    # Initialize LLM
+    llm = ChatGroq(
+        model='llama-3.1-8b-instant',
+        temperature=0,
+        max_tokens=1000,
+        timeout=None,
+        max_retries=2,
+        api_key=groq_key
+    )
+    
+    # Initialize embeddings behind a persistent cache so unchanged chunks are never re-embedded
+    embeddings = CachedEmbeddings(build_embedding_model())
+    
+    return llm, embeddings
+
+
+def build_embedding_model():
+    """Embedding model for the configured backend"""
+    if EMBEDDING_BACKEND == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings('sentence-transformers/all-mpnet-base-v2')
+    
+    # Imported here: it pulls in sentence-transformers and torch, the slowest imports by far
+    from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(
+        model_name='sentence-transformers/all-mpnet-base-v2',
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': True}
+    )
+
+
 def initialize_base_components():
-    """Initialize base RAG components"""
+    """Initialize base RAG components, waiting for the background warm-up if it is still loading them"""
     try:
         
         # Get API keys from session state or environment
@@ -48,27 +90,12 @@ def initialize_base_components():
             st.error("❌ Groq API key required for LLM functionality")
             return None, None
         
-        # Initialize LLM
-        llm = ChatGroq(
-            model='llama-3.1-8b-instant',
-            temperature=0,
-            max_tokens=1000,
-            timeout=None,
-            max_retries=2,
-            api_key=groq_key
-        )
-        
-        # Initialize embeddings
-        embeddings = HuggingFaceEmbeddings(
-            model_name='sentence-transformers/all-mpnet-base-v2',
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
-        
-        return llm, embeddings
+        return start_warmup().components()
         
     except Exception as e:
         st.error(f"Error initializing base components: {e}")
+        # The failed warm-up is cached; drop it so the next rerun starts a fresh one
+        start_warmup.clear()
         return None, None
 
 
@@ -0,0 +1,391 @@
+"""FAISS index construction for large knowledge bases.
+
+Flat indexes search exactly but their cost grows linearly with the number of chunks.
+IVF (inverted file: k-means cells, only `nprobe` of them scanned per query) and HNSW
+(navigable small-world graph, `efSearch` candidates explored per query) trade a little
+recall for much faster search on big corpora.
+
+Vectors can also be stored compressed: fp16 (2 bytes/dim), SQ8 (int8 scalar quantization,
+1 byte/dim) or PQ (product quantization, a few bytes per vector), optionally re-scoring
+the top candidates against fp16 or full float32 copies. Run this module to compare:
+
+    python vector_index.py --kb-key <stored key>
+    python vector_index.py --synthetic 200000 --report compression
+"""
+import os
+import sys
+import math
+import time
+import argparse
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.faiss import dependable_faiss_import
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+INDEX_TYPES = ("auto", "flat", "ivf", "hnsw")
+# auto: flat below VECTOR_INDEX_ANN_MIN_SIZE chunks, HNSW above
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "auto")
+VECTOR_INDEX_ANN_MIN_SIZE = int(os.getenv("VECTOR_INDEX_ANN_MIN_SIZE", "20000"))
+# 0 picks about 4 * sqrt(chunks) cells
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "80"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+STORAGE_TYPES = ("flat", "fp16", "sq8", "pq")
+REFINE_TYPES = ("none", "fp16", "flat")
+VECTOR_INDEX_STORAGE = os.getenv("VECTOR_INDEX_STORAGE", "flat")
+# 0 picks dim / 8 sub-quantizers (96 bytes per 768-dim vector)
+PQ_M = int(os.getenv("PQ_M", "0"))
+PQ_NBITS = int(os.getenv("PQ_NBITS", "8"))
+# Re-score the top k * K_FACTOR compressed candidates against fp16 or float32 copies
+VECTOR_INDEX_REFINE = os.getenv("VECTOR_INDEX_REFINE", "none")
+VECTOR_INDEX_REFINE_K_FACTOR = float(os.getenv("VECTOR_INDEX_REFINE_K_FACTOR", "4"))
+
+# FAISS wants roughly this many training points per IVF cell
+_MIN_POINTS_PER_CELL = 39
+_MAX_TRAINING_POINTS_PER_CELL = 256
+_MAX_TRAINING_POINTS = 100000
+
+
+def choose_index_type(num_vectors: int, index_type: str = None) -> str:
+    """Resolve the configured index type for a corpus of the given size"""
+    index_type = (index_type or VECTOR_INDEX_TYPE).lower()
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {', '.join(INDEX_TYPES)}")
+    if index_type == "auto":
+        return "hnsw" if num_vectors >= VECTOR_INDEX_ANN_MIN_SIZE else "flat"
+    # Too few points to train meaningful IVF cells
+    if index_type == "ivf" and num_vectors < _MIN_POINTS_PER_CELL * 4:
+        return "flat"
+    return index_type
+
+
+def ivf_nlist(num_vectors: int) -> int:
+    nlist = IVF_NLIST or int(4 * math.sqrt(num_vectors))
+    return max(1, min(nlist, num_vectors // _MIN_POINTS_PER_CELL))
+
+
+def pq_m(dim: int) -> int:
+    m = PQ_M or max(1, dim // 8)
+    # Sub-quantizers must split the dimension evenly
+    while dim % m:
+        m -= 1
+    return m
+
+
+def choose_storage(num_vectors: int, storage: str = None, refine: str = None) -> tuple:
+    """Resolve the configured (storage, refine) pair for a corpus of the given size"""
+    storage = (storage or VECTOR_INDEX_STORAGE).lower()
+    refine = (refine or VECTOR_INDEX_REFINE).lower()
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown vector storage {storage!r}, expected one of {', '.join(STORAGE_TYPES)}")
+    if refine not in REFINE_TYPES:
+        raise ValueError(f"Unknown refine type {refine!r}, expected one of {', '.join(REFINE_TYPES)}")
+    # PQ codebooks need enough points to train; small corpora use SQ8 instead
+    if storage == "pq" and num_vectors < (2 ** PQ_NBITS) * _MIN_POINTS_PER_CELL:
+        storage = "sq8"
+    if storage == "flat" or (storage == "fp16" and refine == "fp16"):
+        refine = "none"
+    return storage, refine
+
+
+def index_factory_string(index_type: str, num_vectors: int, dim: int = 768,
+                         storage: str = "flat", refine: str = "none") -> str:
+    codec = {"flat": "Flat", "fp16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{pq_m(dim)}x{PQ_NBITS}"}[storage]
+    if index_type == "ivf":
+        description = f"IVF{ivf_nlist(num_vectors)},{codec}"
+    elif index_type == "hnsw":
+        description = f"HNSW{HNSW_M},{codec}"
+    else:
+        description = codec
+    if refine == "flat":
+        description += ",RFlat"
+    elif refine == "fp16":
+        description += ",Refine(SQfp16)"
+    return description
+
+
+def configure_search(index, nprobe: int = None, ef_search: int = None):
+    """Apply search-time parameters (IVF nprobe, HNSW efSearch) to an index"""
+    faiss = dependable_faiss_import()
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(nprobe or IVF_NPROBE, ivf.nlist)
+    hnsw = _find_hnsw(index)
+    if hnsw is not None:
+        hnsw.hnsw.efSearch = ef_search or HNSW_EF_SEARCH
+    refine = faiss.downcast_index(index)
+    if isinstance(refine, faiss.IndexRefine):
+        refine.k_factor = VECTOR_INDEX_REFINE_K_FACTOR
+    return index
+
+
+def _find_hnsw(index):
+    faiss = dependable_faiss_import()
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return index
+    base_index = getattr(index, "base_index", None)
+    return _find_hnsw(base_index) if base_index is not None else None
+
+
+def build_faiss_index(vectors: np.ndarray, index_type: str = None, storage: str = None, refine: str = None):
+    """Build and fill a FAISS index of the configured type and storage over the given vectors"""
+    faiss = dependable_faiss_import()
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dim = vectors.shape
+    index_type = choose_index_type(num_vectors, index_type)
+    storage, refine = choose_storage(num_vectors, storage, refine)
+
+    index = faiss.index_factory(dim, index_factory_string(index_type, num_vectors, dim, storage, refine))
+    hnsw = _find_hnsw(index)
+    if hnsw is not None:
+        hnsw.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    if not index.is_trained:
+        ivf = faiss.try_extract_index_ivf(index)
+        max_training = ivf.nlist * _MAX_TRAINING_POINTS_PER_CELL if ivf is not None else _MAX_TRAINING_POINTS
+        sample = vectors
+        if num_vectors > max_training:
+            sample = vectors[np.random.default_rng(0).choice(num_vectors, max_training, replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    return configure_search(index)
+
+
+def get_vectors(index) -> np.ndarray:
+    """Read the stored vectors back out of an index (decoded approximations for compressed storage)"""
+    faiss = dependable_faiss_import()
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def source_vectors(vector_db, embeddings, positions: list = None) -> np.ndarray:
+    """Exact float32 vectors of a vector database's chunks (all, or those at `positions`), to rebuild from.
+
+    Flat storage, or a float32 refine copy, holds them as added. Compressed storage only
+    decodes to approximations, and re-encoding those loses recall with every rebuild, so
+    those chunks are embedded again (cache hits with CachedEmbeddings).
+    """
+    faiss = dependable_faiss_import()
+    index = faiss.downcast_index(vector_db.index)
+    if isinstance(index, faiss.IndexRefine) and _storage_name(index.refine_index) == "flat":
+        index = index.refine_index
+    if _storage_name(index) == "flat":
+        vectors = get_vectors(index)
+        return vectors if positions is None else vectors[positions]
+    if positions is None:
+        positions = range(index.ntotal)
+    texts = [vector_db.docstore.search(vector_db.index_to_docstore_id[i]).page_content for i in positions]
+    if not texts:
+        return np.empty((0, index.d), dtype=np.float32)
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+
+def _storage_name(index) -> str:
+    """Vector encoding of a (non-refine) index: flat, fp16, sq8, pq or the FAISS class name"""
+    faiss = dependable_faiss_import()
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexFlat, faiss.IndexIVFFlat)):
+        return "flat"
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return {faiss.ScalarQuantizer.QT_fp16: "fp16", faiss.ScalarQuantizer.QT_8bit: "sq8"}.get(index.sq.qtype, "sq")
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    return type(index).__name__
+
+
+def index_memory_bytes(index) -> int:
+    """Approximate in-memory size of an index (its serialized size)"""
+    faiss = dependable_faiss_import()
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def describe_index(index) -> dict:
+    """Index type, storage and search parameters, for display"""
+    faiss = dependable_faiss_import()
+    info = {"class": type(faiss.downcast_index(index)).__name__, "ntotal": index.ntotal}
+    base_index = faiss.downcast_index(index)
+    info["refine"] = "none"
+    if isinstance(base_index, faiss.IndexRefine):
+        info["refine"] = _storage_name(base_index.refine_index)
+        info["k_factor"] = base_index.k_factor
+        base_index = base_index.base_index
+    info["storage"] = _storage_name(base_index)
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        info.update(type="ivf", nlist=ivf.nlist, nprobe=ivf.nprobe)
+        return info
+    hnsw = _find_hnsw(index)
+    if hnsw is not None:
+        info.update(type="hnsw", M=hnsw.hnsw.nb_neighbors(1), efSearch=hnsw.hnsw.efSearch)
+        return info
+    info["type"] = "flat"
+    return info
+
+
+def index_matches_config(index, index_type: str = None, storage: str = None, refine: str = None) -> bool:
+    """Whether an index already has the type and storage that would be built for it now"""
+    info = describe_index(index)
+    wanted_storage, wanted_refine = choose_storage(index.ntotal, storage, refine)
+    return (info["type"], info["storage"], info["refine"]) == (
+        choose_index_type(index.ntotal, index_type), wanted_storage, wanted_refine
+    )
+
+
+def build_vector_db(embeddings, vectors: np.ndarray, ids: list, documents: list,
+                    index_type: str = None, storage: str = None, refine: str = None):
+    """Vector database over precomputed vectors, keeping the given docstore ids"""
+    index = build_faiss_index(vectors, index_type, storage, refine)
+    return FAISS(
+        embeddings,
+        index,
+        InMemoryDocstore(dict(zip(ids, documents))),
+        dict(enumerate(ids))
+    )
+
+
+def _search_latency(index, queries: np.ndarray, k: int) -> tuple:
+    """Top-k ids per query, searched one at a time as the app does, and per-query latencies"""
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids[i] = index.search(query[None, :], k)
+        latencies[i] = time.perf_counter() - start
+    return ids, latencies
+
+
+def recall_at_k(found: np.ndarray, exact: np.ndarray) -> float:
+    hits = sum(len(set(row[row >= 0]) & set(truth)) for row, truth in zip(found, exact))
+    return hits / exact.size
+
+
+def _measure(index, queries: np.ndarray, k: int, exact_ids: np.ndarray, build_time: float) -> tuple:
+    ids, latencies = _search_latency(index, queries, k)
+    memory = index_memory_bytes(index)
+    return ids, {
+        "build_s": round(build_time, 3),
+        f"recall@{k}": round(recall_at_k(ids, exact_ids), 4) if exact_ids is not None else 1.0,
+        "mean_ms": round(float(latencies.mean()) * 1000, 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "memory_mb": round(memory / 2 ** 20, 2),
+        "bytes_per_vector": round(memory / index.ntotal, 1)
+    }
+
+
+def _timed_build(vectors: np.ndarray, **config) -> tuple:
+    start = time.perf_counter()
+    index = build_faiss_index(vectors, **config)
+    return index, time.perf_counter() - start
+
+
+def recall_latency_report(vectors: np.ndarray, queries: np.ndarray, k: int = 4,
+                          nprobes=(1, 4, 16, 64), ef_searches=(16, 32, 64, 128)) -> list:
+    """Recall@k, per-query latency and memory of IVF and HNSW settings against the exact flat index"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    flat, build_time = _timed_build(vectors, index_type="flat", storage="flat")
+    exact_ids, stats = _measure(flat, queries, k, None, build_time)
+    rows = [{"index_type": "flat", **stats}]
+
+    if choose_index_type(len(vectors), "ivf") == "ivf":
+        ivf, build_time = _timed_build(vectors, index_type="ivf", storage="flat")
+        for nprobe in nprobes:
+            configure_search(ivf, nprobe=nprobe)
+            _, stats = _measure(ivf, queries, k, exact_ids, build_time)
+            rows.append({"index_type": "ivf", "nlist": ivf_nlist(len(vectors)), "nprobe": nprobe, **stats})
+
+    hnsw, build_time = _timed_build(vectors, index_type="hnsw", storage="flat")
+    for ef_search in ef_searches:
+        configure_search(hnsw, ef_search=ef_search)
+        _, stats = _measure(hnsw, queries, k, exact_ids, build_time)
+        rows.append({"index_type": "hnsw", "M": HNSW_M, "efSearch": ef_search, **stats})
+
+    return rows
+
+
+def compression_report(vectors: np.ndarray, queries: np.ndarray, k: int = 4, index_type: str = "flat") -> list:
+    """Memory, recall@k and latency of each storage mode, with and without re-scoring"""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    flat, build_time = _timed_build(vectors, index_type="flat", storage="flat")
+    exact_ids, _ = _measure(flat, queries, k, None, build_time)
+
+    rows = []
+    seen = set()
+    for storage in STORAGE_TYPES:
+        for refine in REFINE_TYPES:
+            config = choose_storage(len(vectors), storage, refine)
+            if config in seen:
+                continue  # Small corpora fall back from PQ to SQ8
+            seen.add(config)
+            index, build_time = _timed_build(vectors, index_type=index_type, storage=config[0], refine=config[1])
+            _, stats = _measure(index, queries, k, exact_ids, build_time)
+            rows.append({"index_type": choose_index_type(len(vectors), index_type),
+                         "storage": config[0], "refine": config[1], **stats})
+    return rows
+
+
+def sample_queries(vectors: np.ndarray, count: int, noise: float = 0.05, seed: int = 0) -> np.ndarray:
+    """Query vectors near stored ones: random stored vectors plus Gaussian noise"""
+    rng = np.random.default_rng(seed)
+    queries = vectors[rng.choice(len(vectors), min(count, len(vectors)), replace=False)].copy()
+    queries += rng.normal(scale=noise * np.linalg.norm(queries, axis=1, keepdims=True).mean() / math.sqrt(vectors.shape[1]),
+                          size=queries.shape)
+    return queries.astype(np.float32)
+
+
+def synthetic_vectors(count: int, dim: int = 768, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Clustered unit vectors, closer to real embeddings than uniform noise"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    vectors = centers[rng.integers(clusters, size=count)] + rng.normal(scale=0.6, size=(count, dim))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description="Recall, latency and memory of FAISS index options against exact search")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--kb-key", help="Stored knowledge base to read vectors from")
+    source.add_argument("--synthetic", type=int, help="Number of synthetic clustered vectors")
+    parser.add_argument("--dim", type=int, default=768, help="Dimension of synthetic vectors")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--report", choices=("ann", "compression", "all"), default="all")
+    parser.add_argument("--index-type", default="flat", help="Index type used for the compression report")
+    args = parser.parse_args(argv)
+
+    if args.kb_key:
+        from kb_store import load_knowledge_base
+        vector_db = load_knowledge_base(args.kb_key, embeddings=None, mmap=False)
+        if vector_db is None:
+            sys.exit(f"Stored knowledge base {args.kb_key} not found")
+        vectors = get_vectors(vector_db.index)
+    else:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+    queries = sample_queries(vectors, args.queries)
+
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}, {len(queries)} queries")
+    rows = []
+    if args.report in ("ann", "all"):
+        rows += recall_latency_report(vectors, queries, k=args.k)
+    if args.report in ("compression", "all"):
+        rows += compression_report(vectors, queries, k=args.k, index_type=args.index_type)
+    for row in rows:
+        params = ", ".join(f"{key}={row[key]}" for key in ("storage", "refine", "nlist", "nprobe", "M", "efSearch") if key in row)
+        print(f"{row['index_type']:<5} {params:<28} build {row['build_s']:>7.2f}s  "
+              f"recall@{args.k} {row[f'recall@{args.k}']:.3f}  mean {row['mean_ms']:.3f} ms  "
+              f"p95 {row['p95_ms']:.3f} ms  {row['memory_mb']:.1f} MB ({row['bytes_per_vector']:.0f} B/vector)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
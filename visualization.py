@@ -1,8 +1,11 @@
+import html
 from utils import get_api_keys
-import plotly.graph_objects as go
+from tracing import iter_spans
 
 def create_pipeline_visualization(system_type: str, route_decision: str = None, processing_steps: list = None):
     """Create enhanced pipeline visualization"""
+    # Imported on use: plotly is slow to import and the chart is optional
+    import plotly.graph_objects as go
     fig = go.Figure()
     
     if system_type == "traditional":
@@ -65,19 +68,26 @@ def create_pipeline_visualization(system_type: str, route_decision: str = None,
     
     return fig
 
-def create_processing_steps_visual(steps: list, system_type: str):
-    """Create visual representation of processing steps"""
-    step_html = "<div style='margin: 1rem 0;'>"
+def create_trace_waterfall(trace: dict) -> str:
+    """Create a per-stage waterfall of a pipeline trace"""
+    total = trace["duration"] or 1e-9
+    rows_html = "<div style='margin: 1rem 0;'>"
     
-    for i, step in enumerate(steps, 1):
-        if system_type == "traditional":
-            step_class = "pipeline-step step-traditional"
-        else:
-            step_class = "pipeline-step step-agentic"
-            
-        step_html += f"<span class='{step_class}'>{i}. {step}</span>"
-        if i < len(steps):
-            step_html += " → "
+    for depth, span in iter_spans(trace):
+        left = span["start"] / total * 100
+        width = span["duration"] / total * 100
+        details = ", ".join(f"{key}={value}" for key, value in span["attributes"].items() if value is not None)
+        bar_class = "trace-bar" if depth <= 1 else "trace-bar trace-bar-nested"
+        label = html.escape(span["name"].replace("_", " "))
+        
+        rows_html += (
+            f"<div class='trace-row' title='{html.escape(details)}'>"
+            f"<span class='trace-label' style='padding-left: {depth * 1.2}rem;'>{label}</span>"
+            f"<span class='trace-track'>"
+            f"<span class='{bar_class}' style='left: {left:.2f}%; width: {width:.2f}%;'></span>"
+            f"<span class='trace-duration'>{span['duration'] * 1000:.0f} ms</span>"
+            f"</span></div>"
+        )
     
-    step_html += "</div>"
-    return step_html
+    rows_html += "</div>"
+    return rows_html
@@ -0,0 +1,163 @@
+import os
+import re
+import copy
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+WEB_CACHE_TTL = float(os.getenv("WEB_CACHE_TTL", "3600"))
+WEB_CACHE_MAX_ENTRIES = int(os.getenv("WEB_CACHE_MAX_ENTRIES", "1024"))
+# Optional SQLite file shared between processes; empty means in-memory only
+WEB_CACHE_PATH = os.getenv("WEB_CACHE_PATH", "")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize a query so trivially different spellings share a cache entry"""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?.! ")
+
+
+class WebResultCache:
+    """TTL + LRU cache for web search results with an optional on-disk backend"""
+
+    def __init__(
+            self,
+            ttl: float = WEB_CACHE_TTL,
+            max_entries: int = WEB_CACHE_MAX_ENTRIES,
+            path: str = WEB_CACHE_PATH
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._lock = threading.Lock()
+
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS web_results "
+                "(key TEXT PRIMARY KEY, expires_at REAL, result TEXT, last_used REAL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(query: str, **params) -> str:
+        return hashlib.sha256(
+            json.dumps({"q": normalize_query(query), **params}, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, query: str, **params):
+        """Cached result for the query and search parameters, or None"""
+        key = self.make_key(query, **params)
+        now = time.time()
+        with self._lock:
+            result = self._get_memory(key, now)
+            if result is None and self._conn is not None:
+                entry = self._get_disk(key, now)
+                if entry is not None:
+                    # Keep the stored expiry: the result is no fresher for having been read
+                    expires_at, result = entry
+                    self._put_memory(key, expires_at, result)
+
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return copy.deepcopy(result)
+
+    def set(self, query: str, result: dict, **params):
+        """Cache a result for the query and search parameters"""
+        key = self.make_key(query, **params)
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, now + self.ttl, copy.deepcopy(result))
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO web_results (key, expires_at, result, last_used) VALUES (?, ?, ?, ?)",
+                    (key, now + self.ttl, json.dumps(result), now)
+                )
+                self._evict_disk(now)
+                self._conn.commit()
+
+    def _get_memory(self, key: str, now: float):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put_memory(self, key: str, expires_at: float, result: dict):
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _get_disk(self, key: str, now: float):
+        """(expires_at, result) of an unexpired stored entry, or None"""
+        row = self._conn.execute(
+            "SELECT expires_at, result FROM web_results WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        if row is None:
+            return None
+        self._conn.execute("UPDATE web_results SET last_used = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+        return row[0], json.loads(row[1])
+
+    def _evict_disk(self, now: float):
+        self._conn.execute("DELETE FROM web_results WHERE expires_at <= ?", (now,))
+        self._conn.execute(
+            "DELETE FROM web_results WHERE key NOT IN "
+            "(SELECT key FROM web_results ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,)
+        )
+
+    def get_stats(self) -> dict:
+        """Get cache hit/miss counters and size"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0,
+                "entries": len(self._entries),
+                "ttl": self.ttl,
+                "shared": self._conn is not None
+            }
+
+    def clear(self):
+        """Remove all cached results"""
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM web_results")
+                self._conn.commit()
+
+
+_web_cache = None
+_web_cache_lock = threading.Lock()
+
+
+def get_web_cache() -> WebResultCache:
+    """Get the process-wide web result cache"""
+    global _web_cache
+    with _web_cache_lock:
+        if _web_cache is None:
+            _web_cache = WebResultCache()
+        return _web_cache
+
+
+def set_web_cache(cache: WebResultCache):
+    """Replace the process-wide web result cache"""
+    global _web_cache
+    with _web_cache_lock:
+        _web_cache = cache